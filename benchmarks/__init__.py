@@ -0,0 +1 @@
+"""Benchmarks for the Candy integration, run them from the repository root with `python -m benchmarks.<name>`"""
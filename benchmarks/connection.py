@@ -0,0 +1,106 @@
+"""
+Connection reuse benchmark: python -m benchmarks.connection
+
+Polls a local stand-in for the Wi-Fi module of an appliance every --poll-interval seconds, once with a session like the
+shared HA session (aiohttp's default 15 second keep-alive) and once with the dedicated kept-alive session, both at the
+same time. The stand-in delays new connections by --connect-delay to model modules that are slow to accept.
+Polling back-to-back would let the shared session reuse its connection too, the interval has to be a real one.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+from custom_components.candy.client import create_device_session
+
+STATUS_BODY = b'{"statusLavatrice":{"WiFiStatus":"0","Err":"255","MachMd":"1","Pr":"1","PrPh":"0"}}'
+
+
+class StandIn:
+    """HTTP server that answers every request with the same status, over kept-alive connections"""
+
+    def __init__(self, connect_delay: float):
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self._handlers: set[asyncio.Task] = set()
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        self._writers.add(writer)
+        await asyncio.sleep(self.connect_delay)
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n\r\n%s"
+                             % (len(STATUS_BODY), STATUS_BODY))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            writer.close()
+
+    async def close_connections(self) -> None:
+        for writer in self._writers:
+            writer.close()
+        await asyncio.gather(*self._handlers)
+
+
+async def poll(session: aiohttp.ClientSession, url: str, polls: int, poll_interval: float) -> list[float]:
+    latencies = []
+    for i in range(polls):
+        if i:
+            await asyncio.sleep(poll_interval)
+        start = time.perf_counter()
+        async with session.get(url) as resp:
+            await resp.read()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def poll_stand_in(session: aiohttp.ClientSession, polls: int, poll_interval: float,
+                        connect_delay: float) -> tuple[list[float], int]:
+    stand_in = StandIn(connect_delay)
+    server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/http-read.json?encrypted=0"
+
+    async with server, session:
+        latencies = await poll(session, url, polls, poll_interval)
+    await stand_in.close_connections()
+    return latencies, stand_in.connections
+
+
+async def run(polls: int, poll_interval: float, connect_delay: float) -> None:
+    print(f"{polls} polls {poll_interval:g} seconds apart, about {polls * poll_interval:.0f} seconds\n")
+    (shared, shared_count), (dedicated, dedicated_count) = await asyncio.gather(
+        # Same keep-alive as the shared HA session
+        poll_stand_in(aiohttp.ClientSession(), polls, poll_interval, connect_delay),
+        poll_stand_in(create_device_session(), polls, poll_interval, connect_delay),
+    )
+
+    print(f"{'session':<16}{'connections':>12}{'mean ms':>10}{'median ms':>11}")
+    for name, latencies, connections in [
+        ("shared", shared, shared_count),
+        ("dedicated", dedicated, dedicated_count),
+    ]:
+        print(f"{name:<16}{connections:>12}{statistics.mean(latencies) * 1000:>10.2f}"
+              f"{statistics.median(latencies) * 1000:>11.2f}")
+    saved = statistics.mean(shared) - statistics.mean(dedicated)
+    print(f"\nSaved per poll: {saved * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=5, help="number of status requests per session")
+    parser.add_argument("--poll-interval", type=float, default=30,
+                        help="seconds between polls, 30 is the interval of a running cycle")
+    parser.add_argument("--connect-delay", type=float, default=0.05,
+                        help="seconds the stand-in waits before serving a new connection")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.polls, args.poll_interval, args.connect_delay))
+
+
+if __name__ == "__main__":
+    main()
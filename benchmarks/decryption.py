@@ -0,0 +1,174 @@
+"""
+Decryption and key recovery benchmarks: python -m benchmarks.decryption
+
+Save a baseline with --save baseline.json, then check a change for regressions with --compare baseline.json
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import string
+import sys
+import time
+import timeit
+
+from custom_components.candy.client.decryption import (KEY_LEN,
+                                                       _expected_tries,
+                                                       _find_candidate_key_codepoints,
+                                                       _find_candidate_keys,
+                                                       _iter_keys_by_rank,
+                                                       _rank_candidates,
+                                                       decrypt, find_key)
+from tests.common import encrypted_fixture, format_like_device
+
+APPLIANCE_FIXTURES = {
+    "washing_machine": "tests/components/washing_machine/fixtures/running_wash.json",
+    "tumble_dryer": "tests/components/tumble_dryer/fixtures/running.json",
+    "oven": "tests/components/oven/fixtures/heating.json",
+    "dishwasher": "tests/components/dishwasher/fixtures/wash.json",
+}
+SIZES = [500, 2000, 8000]
+
+FIXTURES = [
+    "washing_machine/idle.json",
+    "washing_machine/running_wash.json",
+    "washing_machine/delayed_start_wait.json",
+    "washing_machine/no_fillr.json",
+]
+
+# A metric is a regression if it got slower than this compared to the baseline
+REGRESSION_THRESHOLD = 1.5
+
+
+def random_keys(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choices(string.ascii_letters + string.digits, k=KEY_LEN)) for _ in range(count)]
+
+
+def synthetic_response(fixture_path: str, size: int, key: str, seed: int = 0) -> bytes:
+    """Encrypted response of an appliance, padded with extra fields to at least `size` bytes"""
+    rng = random.Random(seed)
+    with open(fixture_path, encoding="utf-8") as file:
+        status = json.load(file)
+    fields = next(iter(status.values()))
+
+    plaintext = format_like_device(status)
+    while len(plaintext) < size:
+        for i in range(len(fields), len(fields) + 10):
+            fields[f"Extra{i}"] = str(rng.randrange(1000))
+        plaintext = format_like_device(status)
+
+    return decrypt(key.encode(), plaintext)
+
+
+def _per_call(func) -> float:
+    """Seconds per call, running the function for at least 0.2 seconds"""
+    (number, elapsed) = timeit.Timer(func).autorange()
+    return elapsed / number
+
+
+def _median(values: list[float]) -> float:
+    return sorted(values)[len(values) // 2]
+
+
+def bench_suite(keys: list[str]) -> dict[str, float]:
+    """Median of each metric over the keys, for every appliance type and payload size"""
+    results = {}
+    print(f"{'appliance':<16} {'size':>5}  {'decrypt (us)':>12}  {'candidates (ms)':>15}  {'find_key (ms)':>13}  "
+          f"{'brute force (ms)':>16}  {'candidate keys':>14}")
+    for (appliance, fixture_path) in APPLIANCE_FIXTURES.items():
+        for size in SIZES:
+            metrics: dict[str, list[float]] = {
+                "decrypt": [], "candidates": [], "find_key": [], "brute_force": [], "candidate_keys": []
+            }
+            for key in keys:
+                response = synthetic_response(fixture_path, size, key)
+                metrics["decrypt"].append(_per_call(lambda r=response, k=key.encode(): decrypt(k, r)))
+                metrics["candidates"].append(_per_call(
+                    lambda r=response: [list(_find_candidate_key_codepoints(r, i)) for i in range(KEY_LEN)]
+                ))
+                metrics["find_key"].append(_per_call(lambda r=response: find_key(r)))
+                metrics["brute_force"].append(_per_call(lambda r=response: find_key(r, known_plaintext=False)))
+                metrics["candidate_keys"].append(math.prod(len(l) for l in _find_candidate_keys(response)))
+
+            row = {f"{appliance}/{size}/{name}": _median(values) for (name, values) in metrics.items()}
+            results.update(row)
+            print(f"{appliance:<16} {size:>5}  {row[f'{appliance}/{size}/decrypt'] * 1e6:>12.2f}  "
+                  f"{row[f'{appliance}/{size}/candidates'] * 1e3:>15.3f}  "
+                  f"{row[f'{appliance}/{size}/find_key'] * 1e3:>13.3f}  "
+                  f"{row[f'{appliance}/{size}/brute_force'] * 1e3:>16.3f}  "
+                  f"{row[f'{appliance}/{size}/candidate_keys']:>14.0f}")
+    return results
+
+
+def bench_multiple_samples(keys: list[str]):
+    print("samples  candidate keys (median)  find_key (ms, median)")
+    for samples in range(1, len(FIXTURES) + 1):
+        key_counts = []
+        timings = []
+        for key in keys:
+            responses = [encrypted_fixture(fixture, key) for fixture in FIXTURES[:samples]]
+            key_counts.append(math.prod(len(l) for l in _find_candidate_keys(responses[0], responses[1:])))
+
+            start = time.perf_counter()
+            found_key = find_key(responses[0], known_plaintext=False, additional_responses=responses[1:])
+            timings.append(time.perf_counter() - start)
+            assert found_key == key
+
+        print(f"{samples:>7}  {_median(key_counts):>23}  {_median(timings) * 1000:>21.2f}")
+
+
+def bench_candidate_order(keys: list[str]):
+    """Number of keys tried before the correct one, in charset order and in rank order"""
+    print("candidate keys  charset order tries  rank order tries  expected tries")
+    for key in keys:
+        # A truncated response leaves more candidates, like a short response from a real device would
+        response = encrypted_fixture("dishwasher/wash.json", key)[:300]
+        candidates = _find_candidate_keys(response)
+        ranked = _rank_candidates(response, candidates)
+        key_codepoints = tuple(key.encode())
+
+        charset_tries = next(i for (i, k) in enumerate(itertools.product(*candidates), 1) if k == key_codepoints)
+        rank_order_tries = next(i for (i, k) in enumerate(_iter_keys_by_rank(ranked), 1) if k == key_codepoints)
+        print(f"{math.prod(len(l) for l in candidates):>14}  {charset_tries:>19}  {rank_order_tries:>16}  "
+              f"{_expected_tries(ranked):>14.1f}")
+
+
+def compare(results: dict[str, float], baseline: dict[str, float]) -> list[str]:
+    return [
+        f"{name}: {baseline[name]:.6g} -> {value:.6g}"
+        for (name, value) in results.items()
+        if name in baseline and value > baseline[name] * REGRESSION_THRESHOLD
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=3, help="number of random keys per payload")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="fail if results are slower than the baseline in this JSON file")
+    args = parser.parse_args()
+
+    keys = random_keys(args.keys)
+    results = bench_suite(keys)
+    print()
+    bench_multiple_samples(keys)
+    print()
+    bench_candidate_order(keys)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file))
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
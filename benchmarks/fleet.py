@@ -0,0 +1,238 @@
+"""
+Fleet load test: python -m benchmarks.fleet --devices 200
+
+Starts N simulated appliances on loopback, in a child process so that they don't share the event loop with Home
+Assistant, and sets up a config entry for each through the real async_setup_entry, then lets the shared scheduler poll
+every coordinator for a number of rounds of --poll-interval seconds. Reports setup time, poll throughput, update
+latency, event loop lag and memory per device, and how bunched up the requests are: the busiest 100 ms of the
+startup, and the most requests the devices received within one second while the scheduler polled them. Compare with
+--startup-stagger 0 and --no-phases.
+
+Runs inside pytest, as the `hass` instance comes from the Home Assistant test fixtures.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from aiolimiter import AsyncLimiter
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.const import CONF_IP_ADDRESS, CONF_PASSWORD
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from benchmarks.simulator import (APPLIANCE_TYPES, ENCRYPTION_HEX,
+                                  ENCRYPTION_KEY, ENCRYPTION_NONE,
+                                  SimulatedAppliance, SimulatorProcess)
+from custom_components.candy.client.ratelimit import RateLimiterRegistry
+from custom_components.candy.const import (CONF_KEY_USE_ENCRYPTION,
+                                           DATA_KEY_COORDINATOR,
+                                           DATA_KEY_SCHEDULER, DOMAIN)
+from custom_components.candy.scheduler import STARTUP_STAGGER
+
+ENCRYPTIONS = [ENCRYPTION_KEY, ENCRYPTION_NONE, ENCRYPTION_HEX]
+KEY = "fbfjlbmmfklfaikm"
+# Seconds between event loop lag samples
+LAG_SAMPLE_INTERVAL = 0.05
+# Seconds of the windows in which startup requests are counted
+BURST_WINDOW = 0.1
+
+# Set by main() for the pytest run
+ENV_DEVICES = "CANDY_FLEET_DEVICES"
+ENV_ROUNDS = "CANDY_FLEET_ROUNDS"
+ENV_POLL_INTERVAL = "CANDY_FLEET_POLL_INTERVAL"
+ENV_LATENCY = "CANDY_FLEET_LATENCY"
+ENV_GLOBAL_RATE = "CANDY_FLEET_GLOBAL_RATE"
+ENV_STARTUP_STAGGER = "CANDY_FLEET_STARTUP_STAGGER"
+ENV_PHASES = "CANDY_FLEET_PHASES"
+
+
+def _appliances(count: int, latency: float, seed: int = 0) -> list[SimulatedAppliance]:
+    """Every appliance type and encryption mode, at a random point of its cycle"""
+    rng = random.Random(seed)
+    machine_types = list(APPLIANCE_TYPES)
+    appliances = []
+    for i in range(count):
+        appliance = SimulatedAppliance(
+            machine_type=machine_types[i % len(machine_types)],
+            encryption=ENCRYPTIONS[i % len(ENCRYPTIONS)],
+            key=KEY,
+            latency=latency,
+            idle_seconds=30,
+            cycle_seconds=60,
+        )
+        appliance._started_at -= rng.uniform(0, 90)
+        appliances.append(appliance)
+    return appliances
+
+
+def _config_entry(device_ip: str, appliance: SimulatedAppliance, index: int) -> MockConfigEntry:
+    data = {CONF_IP_ADDRESS: device_ip, CONF_KEY_USE_ENCRYPTION: appliance.encryption != ENCRYPTION_NONE}
+    if appliance.encryption == ENCRYPTION_KEY:
+        data[CONF_PASSWORD] = appliance.key
+    elif appliance.encryption == ENCRYPTION_HEX:
+        data[CONF_PASSWORD] = ""
+    return MockConfigEntry(domain=DOMAIN, entry_id=f"fleet-{index}", unique_id=device_ip, data=data)
+
+
+async def _measure_loop_lag(lags: list[float]) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        lags.append(loop.time() - start - LAG_SAMPLE_INTERVAL)
+
+
+def _timed_refresh(coordinator, update_times: list[float]) -> None:
+    """Records how long each refresh of the coordinator takes, whoever starts it"""
+    refresh = coordinator.async_refresh
+
+    async def timed_refresh() -> None:
+        start = time.perf_counter()
+        await refresh()
+        update_times.append(time.perf_counter() - start)
+
+    coordinator.async_refresh = timed_refresh
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[percentile - 1]
+
+
+def _peak(times: list[float], window: float) -> int:
+    """Most of the times within any window of the given length"""
+    times = sorted(times)
+    peak = 0
+    first = 0
+    for (last, time_) in enumerate(times):
+        while times[first] <= time_ - window:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def _print_latencies(name: str, values: list[float]) -> None:
+    print(f"{name:<24} p50 {_percentile(values, 50) * 1000:>9.2f} ms   p99 {_percentile(values, 99) * 1000:>9.2f} ms"
+          f"   max {max(values) * 1000:>9.2f} ms")
+
+
+@pytest.mark.skipif(ENV_DEVICES not in os.environ, reason="Run with python -m benchmarks.fleet")
+async def test_fleet(hass, hass_storage, enable_custom_integrations, socket_enabled):
+    devices = int(os.environ[ENV_DEVICES])
+    rounds = int(os.environ[ENV_ROUNDS])
+    poll_interval = timedelta(seconds=float(os.environ[ENV_POLL_INTERVAL]))
+    latency = float(os.environ[ENV_LATENCY])
+    global_rate = float(os.environ[ENV_GLOBAL_RATE])
+    startup_stagger = float(os.environ[ENV_STARTUP_STAGGER])
+    phases = os.environ[ENV_PHASES] == "1"
+    limiters = RateLimiterRegistry(global_limiter=AsyncLimiter(global_rate, 1) if global_rate else None)
+
+    appliances = _appliances(devices, latency)
+    lags: list[float] = []
+    lag_task = asyncio.create_task(_measure_loop_lag(lags))
+
+    # Every device is polled at the same interval, whatever its status, so that the rounds take a known time
+    with patch("custom_components.candy.client._LIMITERS", limiters), \
+            patch("custom_components.candy.scheduler.STARTUP_STAGGER", startup_stagger), \
+            patch("custom_components.candy.coordinator.next_update_interval", return_value=poll_interval), \
+            patch("custom_components.candy.coordinator.retry_interval", return_value=poll_interval), \
+            (contextlib.nullcontext() if phases else patch("custom_components.candy.scheduler.poll_phase",
+                                                           return_value=0.0)):
+        async with SimulatorProcess(appliances) as simulator:
+            entries = [_config_entry(device_ip, appliance, i)
+                       for (i, (device_ip, appliance)) in enumerate(zip(simulator.device_ips, appliances))]
+            for entry in entries:
+                entry.add_to_hass(hass)
+
+            # Tracing allocations would slow down the setup itself, the growth of the peak RSS is close enough
+            memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            setup_start = time.perf_counter()
+            await asyncio.gather(*(hass.config_entries.async_setup(entry.entry_id) for entry in entries))
+            await hass.async_block_till_done()
+            setup_elapsed = time.perf_counter() - setup_start
+            memory_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            startup_requests = [t for appliance in await simulator.collect() for t in appliance.request_times]
+
+            # Entries whose first refresh failed are retried later by HA, they aren't polled here
+            loaded = [entry for entry in entries if entry.state is ConfigEntryState.LOADED]
+            coordinators = [hass.data[DOMAIN][entry.entry_id][DATA_KEY_COORDINATOR] for entry in loaded]
+            scheduler = hass.data[DOMAIN][DATA_KEY_SCHEDULER]
+            update_times: list[float] = []
+            for (entry, coordinator) in zip(loaded, coordinators):
+                _timed_refresh(coordinator, update_times)
+                # Due at its phase of the benchmark interval instead of the interval picked by the first refresh
+                coordinator.poll_interval = poll_interval
+                scheduler.async_add(entry, coordinator)
+            poll_start = time.perf_counter()
+            # Same clock as the request times of the simulator
+            rounds_start = time.monotonic()
+            await asyncio.sleep(rounds * poll_interval.total_seconds())
+            poll_elapsed = time.perf_counter() - poll_start
+            scheduled_requests = [t for appliance in await simulator.collect() for t in appliance.request_times
+                                  if t >= rounds_start]
+
+            failed = sum(not c.last_update_success for c in coordinators)
+            for entry in entries:
+                await hass.config_entries.async_unload(entry.entry_id)
+            await hass.async_block_till_done()
+
+    lag_task.cancel()
+    requests = sum(appliance.requests for appliance in simulator.appliances)
+
+    print(f"\n{devices} devices, {rounds} rounds of {poll_interval.total_seconds():g} s, "
+          f"{latency * 1000:.0f} ms device latency, "
+          f"global limit {f'{global_rate:g}/s' if global_rate else 'off'}")
+    print(f"{'setup':<24} {setup_elapsed:.2f} s for all entries, startup stagger {startup_stagger:g} s")
+    _print_latencies("update", update_times)
+    print(f"{'poll throughput':<24} {len(update_times) / poll_elapsed:.1f} updates/s, {requests} requests served")
+    _print_latencies("event loop lag", lags)
+    print(f"{'startup burst':<24} {_peak(startup_requests, BURST_WINDOW)} requests in the busiest "
+          f"{BURST_WINDOW * 1000:.0f} ms, {len(startup_requests)} in total")
+    print(f"{'scheduled burst':<24} {_peak(scheduled_requests, 1)} requests in the busiest second, "
+          f"{len(scheduled_requests)} in total, phases {'on' if phases else 'off'}")
+    # KiB on Linux
+    print(f"{'memory per device':<24} {(memory_after - memory_before) / devices:.1f} KiB")
+    print(f"{'entries not loaded':<24} {devices - len(loaded)}")
+    print(f"{'failed coordinators':<24} {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3, help="poll intervals to run the scheduler for after the setup")
+    parser.add_argument("--poll-interval", type=float, default=15,
+                        help="seconds between polls of every device, 15 is the shortest interval of the integration")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds before a simulated device responds")
+    parser.add_argument("--global-rate", type=float, default=0,
+                        help="requests per second across all devices, 0 for no global limit")
+    parser.add_argument("--startup-stagger", type=float, default=STARTUP_STAGGER,
+                        help="seconds over which the first refreshes are spread, 0 to refresh every device at once")
+    parser.add_argument("--no-phases", action="store_true",
+                        help="poll every device at the same phase of the interval, like a timer per device would, "
+                             "this also starts them all at once")
+    args = parser.parse_args()
+
+    os.environ[ENV_DEVICES] = str(args.devices)
+    os.environ[ENV_ROUNDS] = str(args.rounds)
+    os.environ[ENV_POLL_INTERVAL] = str(args.poll_interval)
+    os.environ[ENV_LATENCY] = str(args.latency)
+    os.environ[ENV_GLOBAL_RATE] = str(args.global_rate)
+    os.environ[ENV_STARTUP_STAGGER] = str(args.startup_stagger)
+    os.environ[ENV_PHASES] = "0" if args.no_phases else "1"
+    sys.exit(pytest.main([
+        __file__, "-q", "-s", "-p", "pytest_homeassistant_custom_component", "-p", "no:cacheprovider",
+        "--asyncio-mode=auto", "--log-level=WARNING", "-W", "ignore::pytest.PytestAssertRewriteWarning"
+    ]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+JSON parsing benchmarks: python -m benchmarks.json_parsing
+
+Parse throughput of every appliance fixture with the standard library and with orjson, formatted like devices do
+"""
+import glob
+import json
+import os
+import timeit
+
+from custom_components.candy.client import STATUS_TYPES
+from tests.common import format_like_device
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FIXTURES = sorted(glob.glob("tests/components/*/fixtures/*.json"))
+
+
+def _per_call(func) -> float:
+    """Seconds per call, running the function for at least 0.2 seconds"""
+    (number, elapsed) = timeit.Timer(func).autorange()
+    return elapsed / number
+
+
+def _parse_status(loads, payload: bytes):
+    resp_json = loads(payload)
+    for (status_key, status_type) in STATUS_TYPES.items():
+        if status_key in resp_json:
+            return status_type.from_json(resp_json[status_key])
+    raise ValueError("Unknown machine type")
+
+
+def main():
+    if orjson is None:
+        print("orjson isn't installed, only the standard library is measured")
+
+    print(f"{'fixture':<48} {'size':>5}  {'json (MB/s)':>11}  {'orjson (MB/s)':>13}  "
+          f"{'json status (us)':>16}  {'orjson status (us)':>18}")
+    for path in FIXTURES:
+        with open(path, encoding="utf-8") as file:
+            payload = format_like_device(json.load(file))
+        name = os.path.relpath(path, "tests/components")
+
+        stdlib_loads = _per_call(lambda: json.loads(payload))
+        stdlib_status = _per_call(lambda: _parse_status(json.loads, payload))
+        if orjson is not None:
+            orjson_loads = _per_call(lambda: orjson.loads(payload))
+            orjson_status = _per_call(lambda: _parse_status(orjson.loads, payload))
+        else:
+            orjson_loads = orjson_status = float("nan")
+
+        print(f"{name:<48} {len(payload):>5}  {len(payload) / stdlib_loads / 1e6:>11.1f}  "
+              f"{len(payload) / orjson_loads / 1e6:>13.1f}  {stdlib_status * 1e6:>16.2f}  {orjson_status * 1e6:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
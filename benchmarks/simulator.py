@@ -0,0 +1,302 @@
+"""
+Simulator of Candy appliances: python -m benchmarks.simulator --appliance washing_machine:key --appliance oven:none
+
+Every appliance listens on its own port of 127.0.0.1 and serves /http-read.json like a real device: the status moves
+through idle and running cycles over time, encrypted with a key, hex encoded without a key, or as plain JSON.
+Devices also misbehave on demand: they respond with BAD REQUEST when polled too often, respond slowly or drop the
+connection.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import multiprocessing.connection
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+from custom_components.candy.client.decryption import decrypt
+from tests.common import format_like_device
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "components"
+
+# Plain JSON, encrypted with a key, or hex encoded without encryption (see detect_encryption())
+ENCRYPTION_NONE = "none"
+ENCRYPTION_KEY = "key"
+ENCRYPTION_HEX = "hex"
+
+BAD_REQUEST_BODY = b'{"response":"BAD REQUEST"}'
+
+
+@dataclass(frozen=True)
+class ApplianceType:
+    status_key: str
+    idle_fixture: str
+    running_fixture: str
+    # Field of the remaining time and its unit in seconds, None if the appliance doesn't report it
+    remaining_field: Optional[str]
+    remaining_unit: int = 60
+
+
+APPLIANCE_TYPES = {
+    "washing_machine": ApplianceType("statusLavatrice", "washing_machine/fixtures/idle.json",
+                                     "washing_machine/fixtures/running_wash.json", "RemTime", remaining_unit=1),
+    "tumble_dryer": ApplianceType("statusTD", "tumble_dryer/fixtures/idle.json", "tumble_dryer/fixtures/running.json",
+                                  "RemTime"),
+    "oven": ApplianceType("statusForno", "oven/fixtures/idle.json", "oven/fixtures/heating.json", None),
+    "dishwasher": ApplianceType("statusDWash", "dishwasher/fixtures/idle.json", "dishwasher/fixtures/wash.json",
+                                "RemTime"),
+}
+
+
+@dataclass
+class SimulatedAppliance:
+    machine_type: str = "washing_machine"
+    encryption: str = ENCRYPTION_KEY
+    key: str = "fbfjlbmmfklfaikm"
+    # Seconds between requests below which the device responds with BAD REQUEST
+    min_request_interval: float = 0.0
+    # Seconds before responding
+    latency: float = 0.0
+    # Probability of closing the connection without responding
+    drop_rate: float = 0.0
+    # Seconds spent idle, then running, repeated
+    idle_seconds: float = 60.0
+    cycle_seconds: float = 300.0
+
+    requests: int = 0
+    bad_requests: int = 0
+    dropped: int = 0
+    # time.monotonic() of every request
+    request_times: list[float] = field(default_factory=list)
+    _started_at: float = field(default_factory=time.monotonic)
+    _last_request_at: Optional[float] = None
+
+    def status(self, now: float) -> dict:
+        """Status response of the device at the given time of time.monotonic()"""
+        appliance_type = APPLIANCE_TYPES[self.machine_type]
+        position = (now - self._started_at) % (self.idle_seconds + self.cycle_seconds)
+        running = position >= self.idle_seconds
+        fixture = appliance_type.running_fixture if running else appliance_type.idle_fixture
+        status = json.loads(_read_fixture(fixture))
+
+        if running and appliance_type.remaining_field is not None:
+            remaining_seconds = self.cycle_seconds - (position - self.idle_seconds)
+            status[appliance_type.status_key][appliance_type.remaining_field] = \
+                str(round(remaining_seconds / appliance_type.remaining_unit))
+        return status
+
+    def response_body(self, encrypted: bool, now: float) -> bytes:
+        if encrypted != (self.encryption != ENCRYPTION_NONE):
+            return BAD_REQUEST_BODY
+
+        plaintext = format_like_device(self.status(now))
+        if self.encryption == ENCRYPTION_KEY:
+            # XOR encryption is symmetric
+            return decrypt(self.key.encode(), plaintext).hex().upper().encode()
+        if self.encryption == ENCRYPTION_HEX:
+            return plaintext.hex().upper().encode()
+        return plaintext
+
+
+class Simulator:
+    """Serves each appliance on a separate port, devices are identified by the port like by the IP in real life"""
+
+    def __init__(self, appliances: list[SimulatedAppliance], host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+        self.appliances = appliances
+        self.host = host
+        self.port = port
+        self.device_ips: list[str] = []
+        self._random = random.Random(seed)
+        self._by_port: dict[int, SimulatedAppliance] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> list[str]:
+        app = web.Application()
+        app.router.add_get("/http-read.json", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        for (i, appliance) in enumerate(self.appliances):
+            site = web.TCPSite(self._runner, self.host, self.port + i if self.port else 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+            self._by_port[port] = appliance
+            self.device_ips.append(f"{self.host}:{port}")
+        return self.device_ips
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "Simulator":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        appliance = self._by_port[request.transport.get_extra_info("sockname")[1]]
+        appliance.requests += 1
+        now = time.monotonic()
+        appliance.request_times.append(now)
+        too_frequent = (appliance._last_request_at is not None
+                        and now - appliance._last_request_at < appliance.min_request_interval)
+        appliance._last_request_at = now
+
+        if appliance.latency:
+            await asyncio.sleep(appliance.latency)
+
+        if self._random.random() < appliance.drop_rate:
+            appliance.dropped += 1
+            request.transport.close()
+            return web.Response()
+
+        if too_frequent:
+            appliance.bad_requests += 1
+            body = BAD_REQUEST_BODY
+        else:
+            body = appliance.response_body(request.query.get("encrypted") == "1", now)
+        return web.Response(body=body, content_type="text/html")
+
+
+class SimulatorProcess:
+    """
+    Simulator running in a child process, so that serving the appliances doesn't take turns with the code under test
+    on the same event loop. The counters of the appliances are kept in the child, collect() copies them back.
+    request_times are comparable with time.monotonic() of the parent, the monotonic clock is system-wide on Linux.
+    """
+
+    def __init__(self, appliances: list[SimulatedAppliance], host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+        self.appliances = appliances
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.device_ips: list[str] = []
+        self._connection: Optional[multiprocessing.connection.Connection] = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    async def start(self) -> list[str]:
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_serve_in_process, args=(self.appliances, self.host, self.port, self.seed, child_connection),
+            daemon=True
+        )
+        self._process.start()
+        child_connection.close()
+        self.device_ips = await _receive(self._connection)
+        return self.device_ips
+
+    async def collect(self) -> list[SimulatedAppliance]:
+        """Appliances with their counters so far"""
+        self._connection.send("collect")
+        self.appliances = await _receive(self._connection)
+        return self.appliances
+
+    async def stop(self) -> None:
+        if self._process is None:
+            return
+        self._connection.send("stop")
+        self.appliances = await _receive(self._connection)
+        self._process.join()
+        self._connection.close()
+        self._process = None
+
+    async def __aenter__(self) -> "SimulatorProcess":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+
+def _serve_in_process(appliances: list[SimulatedAppliance], host: str, port: int, seed: int,
+                      connection: multiprocessing.connection.Connection) -> None:
+    async def serve():
+        async with Simulator(appliances, host, port, seed) as simulator:
+            connection.send(simulator.device_ips)
+            while await _receive(connection) == "collect":
+                connection.send(appliances)
+        connection.send(appliances)
+
+    asyncio.run(serve())
+
+
+async def _receive(connection: multiprocessing.connection.Connection):
+    """Waits for a message without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(connection.fileno(), lambda: readable.done() or readable.set_result(None))
+    try:
+        await readable
+    finally:
+        loop.remove_reader(connection.fileno())
+    return connection.recv()
+
+
+@functools.lru_cache(maxsize=None)
+def _read_fixture(fixture: str) -> str:
+    return (FIXTURES_DIR / fixture).read_text(encoding="utf-8")
+
+
+def _parse_appliance(value: str) -> tuple[str, str]:
+    machine_type, _, encryption = value.partition(":")
+    if machine_type not in APPLIANCE_TYPES:
+        raise argparse.ArgumentTypeError(f"unknown appliance {machine_type}, choose from {', '.join(APPLIANCE_TYPES)}")
+    if encryption not in ("", ENCRYPTION_NONE, ENCRYPTION_KEY, ENCRYPTION_HEX):
+        raise argparse.ArgumentTypeError(f"unknown encryption {encryption}, choose from none, key, hex")
+    return machine_type, encryption or ENCRYPTION_KEY
+
+
+async def serve(args: argparse.Namespace) -> None:
+    appliances = [
+        SimulatedAppliance(
+            machine_type=machine_type,
+            encryption=encryption,
+            key=args.key,
+            min_request_interval=args.min_request_interval,
+            latency=args.latency,
+            drop_rate=args.drop_rate,
+            idle_seconds=args.idle_seconds,
+            cycle_seconds=args.cycle_seconds,
+        )
+        for (machine_type, encryption) in args.appliance or [("washing_machine", ENCRYPTION_KEY)]
+    ]
+    async with Simulator(appliances, args.host, args.port) as simulator:
+        for (device_ip, appliance) in zip(simulator.device_ips, appliances):
+            key = f", key {appliance.key}" if appliance.encryption == ENCRYPTION_KEY else ""
+            print(f"{appliance.machine_type} at {device_ip}, encryption {appliance.encryption}{key}")
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--appliance", action="append", type=_parse_appliance,
+                        help="appliance type and encryption (none, key or hex), e.g. dishwasher:hex, repeatable")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="port of the first appliance, the rest follow it")
+    parser.add_argument("--key", default="fbfjlbmmfklfaikm", help="encryption key of the appliances")
+    parser.add_argument("--min-request-interval", type=float, default=0.0,
+                        help="seconds between requests below which BAD REQUEST is returned")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before responding")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of dropping the connection")
+    parser.add_argument("--idle-seconds", type=float, default=60.0)
+    parser.add_argument("--cycle-seconds", type=float, default=300.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
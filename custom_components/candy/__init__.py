@@ -1,19 +1,21 @@
 """The Candy integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
 from datetime import timedelta
 
-import async_timeout
-
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_IP_ADDRESS, CONF_PASSWORD
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
-from .client import CandyClient, WashingMachineStatus
+from .client import CandyClient, WashingMachineStatus, create_device_session
+from .client.connection import KEEPALIVE_TIMEOUT
 
 from .const import *
+from .coordinator import CandyDataUpdateCoordinator
+from .scheduler import CandyPollScheduler
+from .storage import CandyStore
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,42 +26,73 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> b
     ip_address = config_entry.data[CONF_IP_ADDRESS]
     encryption_key = config_entry.data.get(CONF_PASSWORD, "")
     use_encryption = config_entry.data.get(CONF_KEY_USE_ENCRYPTION, True)
-
-    session = async_get_clientsession(hass)
-    client = CandyClient(session, ip_address, encryption_key, use_encryption)
-
-    async def update_status():
-        try:
-            async with async_timeout.timeout(40):
-                status = await client.status_with_retry()
-                _LOGGER.debug("Fetched status: %s", status)
-                return status
-        except Exception as err:
-            raise UpdateFailed(f"Error communicating with API: {repr(err)}") from err
-
-    coordinator = DataUpdateCoordinator(
-        hass,
-        _LOGGER,
-        name=DOMAIN,
-        update_interval=timedelta(seconds=60),
-        update_method=update_status,
-    )
-
-    await coordinator.async_config_entry_first_refresh()
-
-    hass.data.setdefault(DOMAIN, {})[config_entry.entry_id] = {
-        DATA_KEY_COORDINATOR: coordinator
+    liveness_probe = config_entry.options.get(CONF_KEY_LIVENESS_PROBE, False)
+    dedicated_connection = config_entry.options.get(CONF_KEY_DEDICATED_CONNECTION, False)
+    stale_window = config_entry.options.get(CONF_KEY_STALE_WINDOW, STALE_WINDOW_DEFAULT)
+
+    store = CandyStore(hass, config_entry.entry_id)
+    await store.async_load()
+
+    if dedicated_connection:
+        session = create_device_session()
+        config_entry.async_on_unload(session.close)
+    else:
+        session = async_get_clientsession(hass)
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_KEY_SCHEDULER not in domain_data:
+        domain_data[DATA_KEY_SCHEDULER] = CandyPollScheduler(hass)
+    scheduler: CandyPollScheduler = domain_data[DATA_KEY_SCHEDULER]
+
+    client = CandyClient(session, ip_address, encryption_key, use_encryption,
+                         request_rate=store.data.get(STORAGE_KEY_REQUEST_RATE), liveness_probe=liveness_probe,
+                         status_key=config_entry.data.get(CONF_KEY_MACHINE_TYPE),
+                         keepalive_timeout=KEEPALIVE_TIMEOUT if dedicated_connection else None,
+                         request_slots=scheduler.request_slots)
+
+    coordinator = CandyDataUpdateCoordinator(hass, client, store, stale_window=timedelta(minutes=stale_window))
+
+    if coordinator.async_restore():
+        # Entities start from the status saved in the last run, setup doesn't wait for slow or offline devices
+        scheduler.async_add(config_entry, coordinator, refresh_soon=True)
+    else:
+        # Entries are set up concurrently after a restart, don't send the first request to every device at once
+        await asyncio.sleep(scheduler.startup_delay(config_entry.entry_id))
+        await coordinator.async_config_entry_first_refresh()
+        scheduler.async_add(config_entry, coordinator)
+    config_entry.async_on_unload(lambda: scheduler.async_remove(config_entry.entry_id))
+
+    if client.status_key != config_entry.data.get(CONF_KEY_MACHINE_TYPE):
+        # Remember the machine type, so that the next setup doesn't have to detect it again
+        hass.config_entries.async_update_entry(
+            config_entry, data={**config_entry.data, CONF_KEY_MACHINE_TYPE: client.status_key}
+        )
+
+    domain_data[config_entry.entry_id] = {
+        DATA_KEY_COORDINATOR: coordinator,
+        DATA_KEY_STORE: store,
     }
 
     await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
 
+    config_entry.async_on_unload(config_entry.add_update_listener(async_reload_entry))
+
     return True
 
 
+async def async_reload_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+    """Reload the config entry when the options change."""
+    await hass.config_entries.async_reload(config_entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        del hass.data[DOMAIN]
+        hass.data[DOMAIN].pop(entry.entry_id)
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the persisted state of a deleted config entry."""
+    await CandyStore(hass, entry.entry_id).async_remove()
@@ -1,76 +1,236 @@
-import json
+import asyncio
+import binascii
+import contextlib
+import hashlib
 import logging
-from json import JSONDecodeError
-from typing import Optional, Tuple, Union
+import time
+from typing import Callable, Optional, Tuple, Union
 
 import aiohttp
 import backoff
 from aiohttp import ClientSession
 
-from aiolimiter import AsyncLimiter
-
-from .decryption import decrypt, Encryption, find_key
+from .circuitbreaker import CircuitBreaker, CircuitOpenError, CircuitState
+from .connection import create_device_session
+from . import jsonbackend
+from .decryption import decrypt_into, Encryption, find_key_in_pool
+from .liveness import DeviceUnreachableError, LivenessProbe
 from .model import (DishwasherStatus, OvenStatus, TumbleDryerStatus,
                     WashingMachineStatus)
+from .ratelimit import RateLimiterRegistry
 
 _LOGGER = logging.getLogger(__name__)
 
+# Seconds for fetching the status, including retries
+STATUS_TIMEOUT = 40
+# Seconds for a single request, so that a hanging request leaves time for retries
+ATTEMPT_TIMEOUT = 10
+# Don't start another attempt with less time left than this until the deadline
+MIN_ATTEMPT_TIME = 2
+MAX_TRIES = 10
+
+# Key of the status object in the response of each machine type
+STATUS_TYPES = {
+    "statusLavatrice": WashingMachineStatus,
+    "statusTD": TumbleDryerStatus,
+    "statusForno": OvenStatus,
+    "statusDWash": DishwasherStatus,
+}
+
+
 # Some devices reportedly can't handle too frequent requests and respond with BAD_REQUEST
-# This global limiter makes sure we don't call the API too fast
+# These limiters make sure we don't call the API of a device too fast, and learn how fast each device can be called
 # https://github.com/ofalvai/home-assistant-candy/issues/61
-_LIMITER = AsyncLimiter(max_rate=1, time_period=3)
+_LIMITERS = RateLimiterRegistry()
+
+
+class BadRequestError(Exception):
+    """The device responded with BAD REQUEST, usually because it was called too frequently"""
 
 
 class CandyClient:
 
-    def __init__(self, session: ClientSession, device_ip: str, encryption_key: str, use_encryption: bool):
-        self.session = session  # Session is the default HA session, shouldn't be cleaned up
+    def __init__(self, session: ClientSession, device_ip: str, encryption_key: str, use_encryption: bool,
+                 request_rate: Optional[float] = None, liveness_probe: bool = False, status_key: Optional[str] = None,
+                 keepalive_timeout: Optional[float] = None, request_slots: Optional[asyncio.Semaphore] = None):
+        self.session = session  # Either the default HA session or a dedicated one, owned by the caller
         self.device_ip = device_ip
         self.encryption_key = encryption_key
+        self._key = encryption_key.encode()
+        self._buffer = bytearray()
         self.use_encryption = use_encryption
+        if request_rate is not None:
+            # Learned rate from a previous run
+            _LIMITERS.limiter(device_ip).rate = request_rate
+        self.circuit_breaker = CircuitBreaker()
+        # Detected from the first response, unless known from a previous run
+        self.status_key = status_key
+        # Skips the HTTP request when the device doesn't even accept TCP connections
+        self.liveness_probe = LivenessProbe(device_ip) if liveness_probe else None
+        # Seconds a dedicated session keeps the connection to the device open after a response
+        self.keepalive_timeout = keepalive_timeout
+        self._last_response_at: Optional[float] = None
+        # Shared with the clients of other devices, bounds the requests in flight to all of them
+        self.request_slots = request_slots
+        self.responses = 0
+        self.unchanged_responses = 0
+        self._last_fingerprint: Optional[bytes] = None
+        self._last_status: Optional[Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]] = None
+        # The status part of the last decoded response, can be saved and restored after a restart
+        self.last_response: Optional[dict] = None
+
+    @property
+    def request_rate(self) -> float:
+        return _LIMITERS.limiter(self.device_ip).rate
+
+    async def status_with_retry(
+            self, timeout: float = STATUS_TIMEOUT
+    ) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
+        """
+        Retry failed requests with exponential backoff until the timeout. Retries stop when there isn't enough
+        time left for another attempt, and are skipped altogether while the circuit breaker is open.
+        """
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError(self.device_ip)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        async def attempt():
+            async with asyncio.timeout(min(ATTEMPT_TIMEOUT, deadline - loop.time())):
+                return await self.status()
 
-    @backoff.on_exception(backoff.expo, aiohttp.ClientError, max_tries=10, logger=__name__)
-    @backoff.on_exception(backoff.expo, TimeoutError, max_tries=10, logger=__name__)
-    async def status_with_retry(self) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
-        return await self.status()
+        # A half-open circuit is probed with a single attempt
+        max_tries = 1 if self.circuit_breaker.state is CircuitState.HALF_OPEN else MAX_TRIES
+        attempt_with_retry = backoff.on_exception(
+            _expo_until,
+            (aiohttp.ClientError, TimeoutError),
+            max_tries=max_tries,
+            max_time=timeout,
+            # Known to be down, retrying wouldn't help
+            giveup=lambda err: isinstance(err, DeviceUnreachableError) or deadline - loop.time() < MIN_ATTEMPT_TIME,
+            logger=__name__,
+            deadline=deadline
+        )(attempt)
+
+        try:
+            async with asyncio.timeout(timeout):
+                status = await attempt_with_retry()
+        except (aiohttp.ClientError, TimeoutError):
+            self.circuit_breaker.on_failure()
+            raise
+        except Exception:
+            # The device responded, but a probe has to succeed for the circuit to close, otherwise it stays half-open
+            if self.circuit_breaker.state is CircuitState.HALF_OPEN:
+                self.circuit_breaker.on_failure()
+            raise
+
+        self.circuit_breaker.on_success()
+        return status
 
     async def status(self) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
+        if (self.liveness_probe is not None and not self._connection_open()
+                and await self.liveness_probe.is_alive() is False):
+            raise DeviceUnreachableError(self.device_ip)
+
         url = _status_url(self.device_ip, self.use_encryption)
-        async with _LIMITER, self.session.get(url) as resp:
-            if self.use_encryption:
-                resp_hex = await resp.text()  # Response is hex encoded, either encrypted or not
-                if self.encryption_key != "":
-                    decrypted_text = decrypt(self.encryption_key.encode(), bytes.fromhex(resp_hex))
-                else:
-                    # Response is just hex encoded without encryption (details in detect_encryption())
-                    decrypted_text = bytes.fromhex(resp_hex)
-                resp_json = json.loads(decrypted_text)
-            else:
-                resp_json = await resp.json(content_type="text/html")
-
-            _LOGGER.debug(resp_json)
-
-            if "statusTD" in resp_json:
-                status = TumbleDryerStatus.from_json(resp_json["statusTD"])
-            elif "statusLavatrice" in resp_json:
-                status = WashingMachineStatus.from_json(resp_json["statusLavatrice"])
-            elif "statusForno" in resp_json:
-                status = OvenStatus.from_json(resp_json["statusForno"])
-            elif "statusDWash" in resp_json:
-                status = DishwasherStatus.from_json(resp_json["statusDWash"])
-            else:
-                raise Exception("Unable to detect machine type from API response", resp_json)
-
-            return status
-
-
-async def detect_encryption(session: aiohttp.ClientSession, device_ip: str) -> Tuple[Encryption, Optional[str]]:
+        request_slot = self.request_slots if self.request_slots is not None else contextlib.nullcontext()
+        async with _LIMITERS.limit(self.device_ip), request_slot, self.session.get(url) as resp:
+            body = await resp.read()
+
+        self._last_response_at = time.monotonic()
+        self.responses += 1
+        fingerprint = hashlib.blake2b(body, digest_size=16).digest()
+        if self._last_status is not None and fingerprint == self._last_fingerprint:
+            # Idle devices keep responding with the same bytes, no need to decode them again
+            self.unchanged_responses += 1
+            _LIMITERS.limiter(self.device_ip).on_success()
+            return self._last_status
+
+        if _is_bad_request(body):
+            _LIMITERS.limiter(self.device_ip).on_bad_request()
+            raise BadRequestError(body.decode(errors="replace"))
+
+        resp_json = jsonbackend.loads(self._decode(body))
+
+        _LOGGER.debug(resp_json)
+        _LIMITERS.limiter(self.device_ip).on_success()
+
+        status = self._parse_status(resp_json)
+
+        self._last_fingerprint = fingerprint
+        self._last_status = status
+        self.last_response = {self.status_key: resp_json[self.status_key]}
+        return status
+
+    def _connection_open(self) -> bool:
+        # The kept-alive connection of the last response is reused, probing with another one would only add a connect
+        return (self.keepalive_timeout is not None and self._last_response_at is not None
+                and time.monotonic() - self._last_response_at < self.keepalive_timeout)
+
+    def restore_status(
+            self, response: dict
+    ) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
+        """Status from a response saved earlier, the machine type is detected from it like from a live response"""
+        status = self._parse_status(response)
+        self.last_response = response
+        return status
+
+    def _parse_status(
+            self, resp_json: dict
+    ) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
+        # A device never changes type, so the status key of the previous response is looked up directly
+        if self.status_key in resp_json:
+            return STATUS_TYPES[self.status_key].from_json(resp_json[self.status_key])
+
+        for status_key, status_type in STATUS_TYPES.items():
+            if status_key in resp_json:
+                _LOGGER.debug("Detected machine type from status key %s", status_key)
+                self.status_key = status_key
+                return status_type.from_json(resp_json[status_key])
+
+        raise Exception("Unable to detect machine type from API response", resp_json)
+
+    def _decode(self, body: bytes) -> Union[bytes, bytearray]:
+        """
+        JSON bytes of the response body. The hex is decoded in one pass, then decrypted into a buffer that is reused
+        between polls, as the response length barely changes.
+        """
+        if not self.use_encryption:
+            return body
+
+        encrypted = binascii.a2b_hex(body.strip())
+        if not self._key:
+            # Response is just hex encoded without encryption (details in detect_encryption())
+            return encrypted
+
+        if len(self._buffer) != len(encrypted):
+            self._buffer = bytearray(len(encrypted))
+        decrypt_into(self._key, encrypted, self._buffer)
+        return self._buffer
+
+    @property
+    def skip_rate(self) -> float:
+        """Share of responses that were the same as the previous one, so decoding them was skipped"""
+        return self.unchanged_responses / self.responses if self.responses else 0.0
+
+
+async def detect_encryption(
+        session: aiohttp.ClientSession,
+        device_ip: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        samples: int = 1
+) -> Tuple[Encryption, Optional[str]]:
+    """
+    If the response is encrypted, the key is first searched for with the known JSON envelope of the response. Only if
+    that fails are up to `samples - 1` more responses fetched to narrow down the candidate keys of the full search.
+    """
     # noinspection PyBroadException
     try:
         _LOGGER.info("Trying to get a response without encryption (encrypted=0)...")
         url = _status_url(device_ip, use_encryption=False)
-        async with _LIMITER, session.get(url) as resp:
-            resp_json = await resp.json(content_type="text/html")
+        async with _LIMITERS.limit(device_ip), session.get(url) as resp:
+            resp_json = jsonbackend.loads(await resp.read())
             assert resp_json.get("response") != "BAD REQUEST"
             _LOGGER.info("Received unencrypted JSON response, no need to use key for decryption")
             return Encryption.NO_ENCRYPTION, None
@@ -78,17 +238,28 @@ async def detect_encryption(session: aiohttp.ClientSession, device_ip: str) -> T
         _LOGGER.debug(err)
         _LOGGER.info("Failed to get a valid response without encryption, let's try with encrypted=1...")
         url = _status_url(device_ip, use_encryption=True)
-        async with _LIMITER, session.get(url) as resp:
+        async with _LIMITERS.limit(device_ip), session.get(url) as resp:
             resp_hex = await resp.text()  # Response is hex encoded encrypted data
             try:
-                json.loads(bytes.fromhex(resp_hex))
+                jsonbackend.loads(bytes.fromhex(resp_hex))
                 _LOGGER.info("Response is not encrypted (despite encryption=1 in request), no need to brute force "
                              "the key")
                 return Encryption.ENCRYPTION_WITHOUT_KEY, None
-            except JSONDecodeError as json_err:
+            except jsonbackend.JSONDecodeError as json_err:
                 _LOGGER.info("Brute force decryption key from the encrypted response...")
                 _LOGGER.debug("Response: %s", resp_hex)
-                key = find_key(bytes.fromhex(resp_hex))
+                encrypted_response = bytes.fromhex(resp_hex)
+                key = await find_key_in_pool(encrypted_response, progress_callback, exhaustive=False)
+                if key is None:
+                    # An idle device keeps sending the same response, which doesn't narrow anything down
+                    additional_responses = [
+                        response for response in await _fetch_samples(session, device_ip, samples - 1)
+                        if response != encrypted_response
+                    ]
+                    # The known plaintext search only has something new to try if the candidates were narrowed down
+                    key = await find_key_in_pool(encrypted_response, progress_callback,
+                                                 known_plaintext=bool(additional_responses),
+                                                 additional_responses=additional_responses)
                 if key is None:
                     raise ValueError("Couldn't brute force key") from json_err
 
@@ -96,5 +267,33 @@ async def detect_encryption(session: aiohttp.ClientSession, device_ip: str) -> T
                 return Encryption.ENCRYPTION, key
 
 
+async def _fetch_samples(session: aiohttp.ClientSession, device_ip: str, count: int) -> list[bytes]:
+    """Encrypted responses for narrowing down the candidate keys, responses that aren't hex encoded are skipped"""
+    url = _status_url(device_ip, use_encryption=True)
+    responses = []
+    for _ in range(count):
+        async with _LIMITERS.limit(device_ip), session.get(url) as resp:
+            body = await resp.read()
+        try:
+            responses.append(binascii.a2b_hex(body.strip()))
+        except (binascii.Error, ValueError):
+            _LOGGER.debug("Skipping invalid sample response: %s", body)
+    return responses
+
+
+def _expo_until(deadline: float):
+    """Exponential backoff that doesn't wait past the point where another attempt would still fit in the deadline"""
+    loop = asyncio.get_running_loop()
+    wait = backoff.expo()
+    yield next(wait)  # Initial .send(None) of backoff
+    for value in wait:
+        yield min(value, max(0.0, deadline - loop.time() - MIN_ATTEMPT_TIME))
+
+
+def _is_bad_request(body: bytes) -> bool:
+    # Neither hex encoded nor status responses contain this
+    return b"BAD REQUEST" in body
+
+
 def _status_url(device_ip: str, use_encryption: bool) -> str:
     return f"http://{device_ip}/http-read.json?encrypted={1 if use_encryption else 0}"
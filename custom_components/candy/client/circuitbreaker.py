@@ -0,0 +1,73 @@
+import logging
+import time
+from enum import Enum
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+# Consecutive failed polls that open the circuit
+FAILURE_THRESHOLD = 3
+# Seconds to wait before probing the device again, doubled after every failed probe
+OPEN_DURATION = 120
+MAX_OPEN_DURATION = 600
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"  # Device is reachable, requests go through with retries
+    OPEN = "open"  # Device is unreachable (e.g. switched off), requests fail immediately
+    HALF_OPEN = "half_open"  # Waited long enough, the next request is a single probe
+
+
+class CircuitOpenError(Exception):
+    """The device has been unreachable recently, the request was skipped"""
+
+
+class CircuitBreaker:
+    """
+    Stops polling a device that keeps failing, so that a switched off appliance doesn't cost retries on every poll
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, open_duration: float = OPEN_DURATION,
+                 max_open_duration: float = MAX_OPEN_DURATION):
+        self.failure_threshold = failure_threshold
+        self.initial_open_duration = open_duration
+        self.max_open_duration = max_open_duration
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.open_duration = open_duration
+        self._opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state is CircuitState.OPEN and time.monotonic() >= self._opened_at + self.open_duration:
+            self.state = CircuitState.HALF_OPEN
+        return self.state is not CircuitState.OPEN
+
+    def on_success(self) -> None:
+        if self.state is not CircuitState.CLOSED:
+            _LOGGER.info("Device is reachable again, closing circuit")
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.open_duration = self.initial_open_duration
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        if self.state is CircuitState.HALF_OPEN:
+            self.open_duration = min(self.open_duration * 2, self.max_open_duration)
+            self._open()
+        elif self.state is CircuitState.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state.value,
+            "failures": self.failures,
+            "open_duration": self.open_duration,
+            "seconds_until_probe": max(0.0, self._opened_at + self.open_duration - time.monotonic())
+            if self.state is CircuitState.OPEN else None,
+        }
+
+    def _open(self) -> None:
+        _LOGGER.info("Device failed %d times in a row, skipping requests for %d seconds", self.failures,
+                     self.open_duration)
+        self.state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
@@ -0,0 +1,24 @@
+import aiohttp
+
+# Seconds to keep an idle connection open. Longer than the longest time between two polls (one and a half quiet hours
+# intervals of 15 minutes, see the scheduler), so consecutive polls reuse the connection instead of waiting for the
+# Wi-Fi module to accept a new one.
+KEEPALIVE_TIMEOUT = 25 * 60
+# Seconds to wait for the device to accept a connection. Devices on the local network either accept quickly or are off.
+CONNECT_TIMEOUT = 3
+
+
+def create_device_session() -> aiohttp.ClientSession:
+    """
+    Session with a single kept-alive connection to one device, instead of the shared HA session that closes idle
+    connections after 15 seconds. The caller owns the session and has to close it.
+    """
+    connector = aiohttp.TCPConnector(
+        # Devices handle one request at a time anyway
+        limit=1,
+        limit_per_host=1,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        # Devices are configured with an IP address, aiohttp doesn't resolve those, there is nothing to cache
+        use_dns_cache=False,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT))
@@ -1,11 +1,25 @@
+import asyncio
+import functools
 import itertools
-import json
 import logging
 import math
+import multiprocessing
+import multiprocessing.synchronize
+import operator
+import os
 import string
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 
-from typing import Optional, Iterable
+from typing import Callable, Iterator, Optional, Iterable, Union
+
+from . import jsonbackend
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
 
 # Adapted from https://www.online-python.com/pm93n5Sqg4
 
@@ -15,6 +29,55 @@ KEY_LEN = 16
 KEY_CHARSET_CODEPOINTS: list[int] = [ord(c) for c in string.ascii_letters + string.digits]
 PLAINTEXT_CHARSET_CODEPOINTS: list[int] = [ord(c) for c in string.printable]
 
+# For each key codepoint, the encrypted bytes that decrypt to a plaintext character.
+# Deleting these from a slice of the response with bytes.translate() leaves nothing if the key codepoint is valid.
+_VALID_ENCRYPTED_BYTES: dict[int, bytes] = {
+    point: bytes(byte for byte in range(256) if point ^ byte in PLAINTEXT_CHARSET_CODEPOINTS)
+    for point in KEY_CHARSET_CODEPOINTS
+}
+
+# Every decrypted response starts with the same JSON envelope, only the appliance type and the whitespace varies.
+# XOR-ing these with the start of the ciphertext yields the key bytes directly.
+STATUS_KEYS = ["statusLavatrice", "statusTD", "statusForno", "statusDWash"]
+KNOWN_PLAINTEXT_PREFIXES: list[bytes] = [
+    f'{{{newline}{indent}"{status_key}":{{{newline}'.encode()
+    for status_key in STATUS_KEYS for newline in ["\r\n", "\n"] for indent in ["\t", "    ", "  "]
+] + [
+    # Unknown appliance type, this still fixes most key positions
+    f'{{{newline}{indent}"status'.encode() for newline in ["\r\n", "\n"] for indent in ["\t", "    ", "  "]
+]
+
+# Typical decrypted content, used to rank key candidates by how natural their decrypted bytes look
+_SAMPLE_PLAINTEXT = (
+    b'{\r\n\t"statusLavatrice":{\r\n\t\t"WiFiStatus":"1",\r\n\t\t"Err":"255",\r\n\t\t"MachMd":"2",\r\n'
+    b'\t\t"Pr":"11",\r\n\t\t"PrPh":"2",\r\n\t\t"SLevel":"255",\r\n\t\t"Temp":"40",\r\n\t\t"SpinSp":"8",\r\n'
+    b'\t\t"Opt1":"0",\r\n\t\t"Steam":"0",\r\n\t\t"DryT":"0",\r\n\t\t"DelVal":"255",\r\n\t\t"RemTime":"3180",\r\n'
+    b'\t\t"RecipeId":"0",\r\n\t\t"CheckUpState":"0",\r\n\t\t"FillR":"35"\r\n\t}\r\n}'
+    b'{\r\n\t"statusTD":{\r\n\t\t"StatoWiFi":"1",\r\n\t\t"StatoTD":"2",\r\n\t\t"PrPh":"2",\r\n\t\t"Pr":"1",\r\n'
+    b'\t\t"DryLev":"2",\r\n\t\t"DryingManagerLevel":"3",\r\n\t\t"RemTime":"120",\r\n\t\t"DoorState":"1"\r\n\t}\r\n}'
+    b'{\r\n\t"statusForno":{\r\n\t\t"StatoWiFi":"0",\r\n\t\t"CodiceErrore":"E0",\r\n\t\t"StartStop":"1",\r\n'
+    b'\t\t"Selettore":"1",\r\n\t\t"Program":"2",\r\n\t\t"TempRead":"310",\r\n\t\t"TempSetRaggiunta":"0"\r\n\t}\r\n}'
+    b'{\r\n\t"statusDWash":{\r\n\t\t"StatoWiFi":"1",\r\n\t\t"StatoDWash":"2",\r\n\t\t"Program":"P5",\r\n'
+    b'\t\t"OpzProg":"p",\r\n\t\t"DelayStart":"0",\r\n\t\t"RemTime":"120",\r\n\t\t"MissSalt":"1"\r\n\t}\r\n}'
+)
+# Log-probability of each byte in the sample, with add-one smoothing over the plaintext charset
+_PLAINTEXT_LOG_FREQUENCIES: dict[int, float] = {
+    point: math.log((_SAMPLE_PLAINTEXT.count(point) + 1) / (len(_SAMPLE_PLAINTEXT) + len(PLAINTEXT_CHARSET_CODEPOINTS)))
+    for point in PLAINTEXT_CHARSET_CODEPOINTS
+}
+
+# Below this many candidate keys, spawning worker processes costs more than the search itself
+PROCESS_POOL_MIN_KEYS = 100_000
+# Partitions are queued per worker so that cancellation only has to wait for small chunks of work
+PARTITIONS_PER_WORKER = 4
+# Keys tested between checks of the stop event in worker processes
+STOP_CHECK_INTERVAL = 1024
+
+# Set by the process pool initializer, tells workers to abandon their partition once the search is over
+_stop_event: Optional[multiprocessing.synchronize.Event] = None
+
+StopEvent = Union[threading.Event, multiprocessing.synchronize.Event]
+
 
 class Encryption(Enum):
     NO_ENCRYPTION = 1  # Use `encrypted=0` in request, response is plaintext JSON
@@ -25,15 +88,163 @@ class Encryption(Enum):
     ENCRYPTION_WITHOUT_KEY = 3
 
 
-def find_key(encrypted_response: bytes) -> Optional[str]:
+def find_key(
+        encrypted_response: bytes,
+        known_plaintext: bool = True,
+        additional_responses: Iterable[bytes] = ()
+) -> Optional[str]:
+    """
+    Additional responses encrypted with the same key narrow down the candidates of each key position
+    """
+    candidate_key_codepoints = _find_candidate_keys(encrypted_response, additional_responses)
+    if known_plaintext:
+        key = _find_key_with_known_plaintext(encrypted_response, candidate_key_codepoints)
+        if key is not None:
+            return key
+    return _find_key_in_candidates(encrypted_response, candidate_key_codepoints)
+
+
+async def find_key_in_pool(
+        encrypted_response: bytes,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        known_plaintext: bool = True,
+        additional_responses: Iterable[bytes] = (),
+        exhaustive: bool = True
+) -> Optional[str]:
+    """
+    Same as find_key(), but runs the search off the event loop. Without `exhaustive`, only the known plaintext
+    search is done. Each key space, constrained by a known plaintext or not, is searched in a thread if it's small,
+    otherwise it's partitioned and searched in a process pool. Once a key is found, or the coroutine is cancelled,
+    the search is told to stop and isn't waited for.
+    """
+    candidate_key_codepoints = _find_candidate_keys(encrypted_response, additional_responses)
+
+    if known_plaintext:
+        for constrained_codepoints in _known_plaintext_candidates(encrypted_response, candidate_key_codepoints):
+            key = await _search(encrypted_response, constrained_codepoints, progress_callback)
+            if key is not None:
+                return key
+    if not exhaustive:
+        return None
+
+    return await _search(encrypted_response, candidate_key_codepoints, progress_callback)
+
+
+async def _search(encrypted_response: bytes, candidate_key_codepoints: list[list[int]],
+                  progress_callback: Optional[Callable[[int, int], None]]) -> Optional[str]:
+    if math.prod(len(l) for l in candidate_key_codepoints) < PROCESS_POOL_MIN_KEYS:
+        return await _search_in_thread(encrypted_response, candidate_key_codepoints)
+    return await _search_in_pool(encrypted_response, candidate_key_codepoints, progress_callback)
+
+
+async def _search_in_thread(encrypted_response: bytes, candidate_key_codepoints: list[list[int]]) -> Optional[str]:
+    """Searches in the default executor, and stops the search when the coroutine is cancelled"""
+    stop_event = threading.Event()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, _find_key_in_candidates, encrypted_response,
+                                                                candidate_key_codepoints, stop_event)
+    finally:
+        stop_event.set()
+
+
+async def _search_in_pool(encrypted_response: bytes, candidate_key_codepoints: list[list[int]],
+                          progress_callback: Optional[Callable[[int, int], None]]) -> Optional[str]:
+    loop = asyncio.get_running_loop()
+    workers = os.cpu_count() or 1
+    partitions = _partition_key_space(candidate_key_codepoints, workers * PARTITIONS_PER_WORKER)
+    _LOGGER.info("Searching %d partitions with %d worker processes", len(partitions), workers)
+
+    # Forking a process with running threads (such as Home Assistant) is unsafe
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_search_worker,
+                                   initargs=(stop_event,))
+    futures = [
+        loop.run_in_executor(executor, _find_key_in_candidates, encrypted_response, partition)
+        for partition in partitions
+    ]
+    try:
+        for done, future in enumerate(asyncio.as_completed(futures), start=1):
+            key = await future
+            if progress_callback is not None:
+                progress_callback(done, len(partitions))
+            if key is not None:
+                return key
+        return None
+    finally:
+        # Running partitions return within STOP_CHECK_INTERVAL keys, then the workers exit
+        stop_event.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def decrypt(key: bytes, encrypted_response: bytes) -> bytes:
+    """
+    XOR the whole response with the repeated key at once. The keystream is cached, as a device always uses
+    the same key and the response length barely changes between polls.
+    """
+    length = len(encrypted_response)
+    keystream = _keystream(bytes(key), length)
+    if np is not None:
+        return np.bitwise_xor(np.frombuffer(encrypted_response, dtype=np.uint8), keystream).tobytes()
+    return (int.from_bytes(encrypted_response, "little") ^ keystream).to_bytes(length, "little")
+
+
+def decrypt_into(key: bytes, encrypted_response: bytes, out: bytearray) -> None:
+    """Same as decrypt(), but writes the result into `out`, which has to be as long as the response"""
+    keystream = _keystream(bytes(key), len(encrypted_response))
+    if np is not None:
+        np.bitwise_xor(np.frombuffer(encrypted_response, dtype=np.uint8), keystream,
+                       out=np.frombuffer(out, dtype=np.uint8))
+    else:
+        out[:] = decrypt(key, encrypted_response)
+
+
+@functools.lru_cache(maxsize=64)
+def _keystream(key: bytes, length: int):
+    """The key repeated to the given length, as a NumPy array if available, otherwise as a big int"""
+    repeated_key = (key * (length // len(key) + 1))[:length]
+    if np is not None:
+        return np.frombuffer(repeated_key, dtype=np.uint8)
+    return int.from_bytes(repeated_key, "little")
+
+
+def _find_candidate_keys(encrypted_response: bytes, additional_responses: Iterable[bytes] = ()) -> list[list[int]]:
     candidate_key_codepoints: list[list[int]] = [
-        list(_find_candidate_key_codepoints(encrypted_response, i)) for i in range(16)
+        list(_find_candidate_key_codepoints(encrypted_response, i)) for i in range(KEY_LEN)
     ]
 
+    # A key position has to decrypt every response to plaintext, so only the intersection of candidates remains
+    for response in additional_responses:
+        for (i, points) in enumerate(candidate_key_codepoints):
+            response_points = set(_find_candidate_key_codepoints(response, i))
+            candidate_key_codepoints[i] = [point for point in points if point in response_points]
+
     number_of_keys = math.prod(len(l) for l in candidate_key_codepoints)
     _LOGGER.info("%d keys to test", number_of_keys)
 
-    for key in itertools.product(*candidate_key_codepoints):
+    return candidate_key_codepoints
+
+
+def _init_search_worker(stop_event: Optional[multiprocessing.synchronize.Event]) -> None:
+    global _stop_event  # pylint: disable=global-statement
+    _stop_event = stop_event
+
+
+def _find_key_in_candidates(encrypted_response: bytes, candidate_key_codepoints: list[list[int]],
+                            stop_event: Optional[StopEvent] = None) -> Optional[str]:
+    """Tries every candidate key, until one decrypts the response to valid JSON or `stop_event` is set"""
+    if stop_event is None:
+        # Pool workers get the event of the search in the initializer
+        stop_event = _stop_event
+    ranked_codepoints = _rank_candidates(encrypted_response, candidate_key_codepoints)
+    for (tries, key) in enumerate(_iter_keys_by_rank(ranked_codepoints)):
+        if stop_event is not None and tries % STOP_CHECK_INTERVAL == 0 and stop_event.is_set():
+            return None
+        # Most keys are rejected after a few bytes, only the survivors are decrypted and parsed fully
+        if not _is_json_prefix(key, encrypted_response):
+            continue
         decrypted = decrypt(key, encrypted_response)
         if _is_valid_json(decrypted):
             key_str = "".join(chr(point) for point in key)
@@ -43,24 +254,206 @@ def find_key(encrypted_response: bytes) -> Optional[str]:
     return None
 
 
-def decrypt(key: bytes, encrypted_response: bytes) -> bytes:
-    key_len = len(key)
-    decrypted: list[int] = []
-    for (i, byte) in enumerate(encrypted_response):
-        decrypted.append(byte ^ key[i % key_len])
-    return bytes(decrypted)
+def _find_key_with_known_plaintext(encrypted_response: bytes,
+                                   candidate_key_codepoints: list[list[int]]) -> Optional[str]:
+    for constrained_codepoints in _known_plaintext_candidates(encrypted_response, candidate_key_codepoints):
+        key = _find_key_in_candidates(encrypted_response, constrained_codepoints)
+        if key is not None:
+            return key
+
+    return None
+
+
+def _known_plaintext_candidates(encrypted_response: bytes,
+                                candidate_key_codepoints: list[list[int]]) -> Iterator[list[list[int]]]:
+    """The candidates constrained by each known plaintext that can be at the start of the response"""
+    for prefix in KNOWN_PLAINTEXT_PREFIXES:
+        constrained_codepoints = _constrain_candidates(encrypted_response, prefix, candidate_key_codepoints)
+        if constrained_codepoints is None:
+            continue
+
+        _LOGGER.info("Response matches known plaintext %r, %d keys to test", prefix,
+                     math.prod(len(l) for l in constrained_codepoints))
+        yield constrained_codepoints
+
+
+def _constrain_candidates(encrypted_response: bytes, known_plaintext: bytes,
+                          candidate_key_codepoints: list[list[int]]) -> Optional[list[list[int]]]:
+    """
+    Fix the key positions covered by the known plaintext, or return None if the plaintext can't be at the start
+    of the response with any of the candidate keys
+    """
+    constrained_codepoints = list(candidate_key_codepoints)
+    for (i, (encrypted_byte, plaintext_byte)) in enumerate(zip(encrypted_response, known_plaintext)):
+        point = encrypted_byte ^ plaintext_byte
+        if point not in constrained_codepoints[i % KEY_LEN]:
+            return None
+        constrained_codepoints[i % KEY_LEN] = [point]
+    return constrained_codepoints
+
+
+def _rank_candidates(encrypted_response: bytes,
+                     candidate_key_codepoints: list[list[int]]) -> list[list[tuple[float, int]]]:
+    """
+    Score each candidate of a key position by the log-likelihood of its decrypted bytes being Candy JSON,
+    and sort the candidates from most to least likely
+    """
+    ranked_codepoints = []
+    for (i, points) in enumerate(candidate_key_codepoints):
+        column = encrypted_response[i::KEY_LEN]
+        scored = [
+            (sum(_PLAINTEXT_LOG_FREQUENCIES[point ^ byte] for byte in column), point)
+            for point in points
+        ]
+        ranked_codepoints.append(sorted(scored, reverse=True))
+
+    _LOGGER.info("Expected number of keys to test: ~%d", _expected_tries(ranked_codepoints))
+    return ranked_codepoints
+
+
+def _expected_tries(ranked_codepoints: list[list[tuple[float, int]]]) -> float:
+    """
+    Estimate from the expected rank of the correct candidate at each key position,
+    treating the normalized likelihoods as the probability of each candidate being correct
+    """
+    expected_tries = 1.0
+    for scored in ranked_codepoints:
+        if not scored:
+            return 0
+        best_score = scored[0][0]
+        likelihoods = [math.exp(score - best_score) for (score, _) in scored]
+        expected_tries *= sum(rank * likelihood for (rank, likelihood) in enumerate(likelihoods, 1)) / sum(likelihoods)
+    return expected_tries
+
+
+def _iter_keys_by_rank(ranked_codepoints: list[list[tuple[float, int]]]) -> Iterator[tuple[int, ...]]:
+    """
+    Enumerate the product of candidates with each key position in rank order. Positions whose best candidate is the
+    most likely vary the slowest, so the first keys only differ from the most likely key in the uncertain positions.
+    Close to best-first order, but with constant memory and no bookkeeping per key.
+    """
+    def best_candidate_probability(scored: list[tuple[float, int]]) -> float:
+        if not scored:
+            return 0.0
+        best_score = scored[0][0]
+        return 1 / sum(math.exp(score - best_score) for (score, _) in scored)
+
+    order = sorted(range(len(ranked_codepoints)), key=lambda i: best_candidate_probability(ranked_codepoints[i]),
+                   reverse=True)
+    # Puts the key positions of a combination back in key order
+    to_key_order = operator.itemgetter(*(order.index(i) for i in range(len(order))))
+    for combination in itertools.product(*([point for (_, point) in ranked_codepoints[i]] for i in order)):
+        yield to_key_order(combination)
+
+
+def _partition_key_space(candidate_key_codepoints: list[list[int]], partitions: int) -> list[list[list[int]]]:
+    """
+    Split the product of candidates into disjoint sub-spaces by fixing the widest key positions one by one
+    """
+    result = [candidate_key_codepoints]
+    while len(result) < partitions:
+        position = max(enumerate(result[0]), key=lambda item: len(item[1]))[0]
+        if len(result[0][position]) <= 1:
+            break
+        result = [
+            [[point] if i == position else points for (i, points) in enumerate(space)]
+            for space in result for point in space[position]
+        ]
+    return result
 
 
 def _find_candidate_key_codepoints(encrypted_response: bytes, key_offset: int) -> Iterable[int]:
-    bytes_to_check: bytes = encrypted_response[key_offset::KEY_LEN]
+    # Each distinct byte only needs to be checked once, this keeps the check cheap for long responses
+    bytes_to_check: bytes = bytes(set(encrypted_response[key_offset::KEY_LEN]))
     for point in KEY_CHARSET_CODEPOINTS:
-        if all(point ^ byte in PLAINTEXT_CHARSET_CODEPOINTS for byte in bytes_to_check):
+        if not bytes_to_check.translate(None, _VALID_ENCRYPTED_BYTES[point]):
             yield point
 
 
+_WHITESPACE = frozenset(b" \t\r\n")
+# Numbers, true, false and null
+_BARE_VALUE = frozenset(b"0123456789+-.eEtruefalsn")
+
+# States of the _is_json_prefix() state machine
+_VALUE = 0  # Expecting a value
+_VALUE_OR_END = 1  # Expecting a value or the end of an empty array
+_KEY = 2  # Expecting an object key
+_KEY_OR_END = 3  # Expecting an object key or the end of an empty object
+_COLON = 4  # Expecting the colon after a key
+_AFTER_VALUE = 5  # Expecting a comma or the end of the container
+_STRING = 6  # Inside a string value
+_KEY_STRING = 7  # Inside a key
+_ESCAPE = 8  # After a backslash in a string value
+_KEY_ESCAPE = 9  # After a backslash in a key
+_BARE = 10  # Inside a number, true, false or null
+
+
+def _is_json_prefix(key: bytes, encrypted_response: bytes) -> bool:
+    """
+    Decrypt the response byte by byte and return False at the first byte that can't appear at that point of a JSON
+    document. This only checks the structure, the values are validated by a full parse of the survivors.
+    """
+    state = _VALUE
+    containers: list[int] = []  # Open brackets
+    for byte in map(int.__xor__, encrypted_response, itertools.cycle(key)):
+        if state == _STRING or state == _KEY_STRING:
+            if byte == 0x22:  # "
+                state = _AFTER_VALUE if state == _STRING else _COLON
+            elif byte == 0x5C:  # \
+                state = _ESCAPE if state == _STRING else _KEY_ESCAPE
+            elif byte < 0x20:
+                return False
+            continue
+        if state == _ESCAPE or state == _KEY_ESCAPE:
+            state = _STRING if state == _ESCAPE else _KEY_STRING
+            continue
+        if state == _BARE:
+            if byte in _BARE_VALUE:
+                continue
+            state = _AFTER_VALUE
+        if byte in _WHITESPACE:
+            continue
+
+        if state == _VALUE or state == _VALUE_OR_END:
+            if byte == 0x22:
+                state = _STRING
+            elif byte == 0x7B or byte == 0x5B:  # { [
+                containers.append(byte)
+                state = _KEY_OR_END if byte == 0x7B else _VALUE_OR_END
+            elif byte in _BARE_VALUE:
+                state = _BARE
+            elif byte == 0x5D and state == _VALUE_OR_END:  # ]
+                containers.pop()
+                state = _AFTER_VALUE
+            else:
+                return False
+        elif state == _KEY or state == _KEY_OR_END:
+            if byte == 0x22:
+                state = _KEY_STRING
+            elif byte == 0x7D and state == _KEY_OR_END:  # }
+                containers.pop()
+                state = _AFTER_VALUE
+            else:
+                return False
+        elif state == _COLON:
+            if byte != 0x3A:  # :
+                return False
+            state = _VALUE
+        else:  # _AFTER_VALUE
+            if not containers:
+                return False  # Only whitespace can follow the document
+            if byte == 0x2C:  # ,
+                state = _KEY if containers[-1] == 0x7B else _VALUE
+            elif byte == containers[-1] + 2:  # } or ], the closing pair of the open bracket
+                containers.pop()
+            else:
+                return False
+    return True
+
+
 def _is_valid_json(decrypted: bytes) -> bool:
     try:
-        json.loads(decrypted)
-    except json.JSONDecodeError:
+        jsonbackend.loads(decrypted)
+    except jsonbackend.JSONDecodeError:
         return False
     return True
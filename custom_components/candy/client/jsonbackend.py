@@ -0,0 +1,23 @@
+"""
+JSON parsing with orjson when it's available (Home Assistant installs it), otherwise with the standard library
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of this, so it catches errors of either backend
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def backend_name() -> str:
+    return "orjson" if orjson is not None else "json"
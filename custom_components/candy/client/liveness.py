@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds to wait for the TCP handshake. Devices on the local network answer in milliseconds when they are on.
+PROBE_TIMEOUT = 1
+# Seconds to reuse the result of a probe, so that retries don't probe again right away
+PROBE_CACHE_SECONDS = 5
+
+
+class DeviceUnreachableError(aiohttp.ClientConnectionError):
+    """The liveness probe couldn't connect to the device, the status request was skipped"""
+
+
+class LivenessProbe:
+    """
+    Checks if the device accepts TCP connections before making a full HTTP request. A switched off device
+    refuses the connection right away or fails the probe within PROBE_TIMEOUT, instead of the HTTP connect timeout and
+    the retries. A probe that times out is inconclusive, a busy Wi-Fi module can be slow to accept connections.
+    """
+
+    def __init__(self, device_ip: str, timeout: float = PROBE_TIMEOUT, cache_seconds: float = PROBE_CACHE_SECONDS):
+        host, _, port = device_ip.partition(":")
+        self.host = host
+        self.port = int(port) if port else 80
+        self.timeout = timeout
+        self.cache_seconds = cache_seconds
+        self._alive: Optional[bool] = None
+        self._checked_at = 0.0
+
+    async def is_alive(self) -> Optional[bool]:
+        """True or False when the device accepted or refused the connection, None when the probe timed out"""
+        if self._alive is not None and time.monotonic() - self._checked_at < self.cache_seconds:
+            return self._alive
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                _, writer = await asyncio.open_connection(self.host, self.port)
+                writer.close()
+                await writer.wait_closed()
+            alive = True
+        except TimeoutError:
+            _LOGGER.debug("Liveness probe of %s:%d timed out", self.host, self.port)
+            return None
+        except OSError as err:
+            _LOGGER.debug("Liveness probe of %s:%d failed: %s", self.host, self.port, repr(err))
+            alive = False
+
+        self._alive = alive
+        self._checked_at = time.monotonic()
+        return alive
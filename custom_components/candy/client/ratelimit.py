@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Optional
+
+from aiolimiter import AsyncLimiter
+
+_LOGGER = logging.getLogger(__name__)
+
+# Requests per second
+DEFAULT_REQUEST_RATE = 1 / 3
+MIN_REQUEST_RATE = 1 / 30
+MAX_REQUEST_RATE = 1
+# Additive increase after each successful request, multiplicative decrease after a BAD REQUEST response
+REQUEST_RATE_INCREASE = 0.01
+REQUEST_RATE_DECREASE = 0.5
+
+
+class AdaptiveRateLimiter:
+    """
+    Spaces the requests to a device according to a request rate that is learned with AIMD:
+    the rate increases slowly while requests that had to wait succeed, and is halved when the device responds with
+    BAD REQUEST.
+    """
+
+    def __init__(self, rate: float, min_rate: float = MIN_REQUEST_RATE, max_rate: float = MAX_REQUEST_RATE):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = rate
+        self._next_request_time = 0.0
+        self._waited = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float) -> None:
+        self._rate = min(max(rate, self.min_rate), self.max_rate)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_request_time - loop.time()
+            self._waited = delay > 0
+            if self._waited:
+                await asyncio.sleep(delay)
+            self._next_request_time = loop.time() + 1 / self.rate
+
+    def on_success(self) -> None:
+        # A request that didn't wait says nothing about whether the device tolerates a higher rate
+        if not self._waited:
+            return
+        self._waited = False
+        self.rate = min(self.rate + REQUEST_RATE_INCREASE, self.max_rate)
+
+    def on_bad_request(self) -> None:
+        self.rate = max(self.rate * REQUEST_RATE_DECREASE, self.min_rate)
+        _LOGGER.info("Device rejected the request, decreasing request rate to %.3f/s", self.rate)
+
+
+class RateLimiterRegistry:
+    """
+    Rate limiters keyed by device IP, so that devices are limited independently of each other.
+    An optional global limiter caps the total request rate of all devices.
+    """
+
+    def __init__(self, initial_rate: float = DEFAULT_REQUEST_RATE, min_rate: float = MIN_REQUEST_RATE,
+                 max_rate: float = MAX_REQUEST_RATE, global_limiter: Optional[AsyncLimiter] = None):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.global_limiter = global_limiter
+        self._limiters: dict[str, AdaptiveRateLimiter] = {}
+
+    def limiter(self, device_ip: str) -> AdaptiveRateLimiter:
+        limiter = self._limiters.get(device_ip)
+        if limiter is None:
+            limiter = self._limiters[device_ip] = AdaptiveRateLimiter(self.initial_rate, self.min_rate, self.max_rate)
+        return limiter
+
+    @contextlib.asynccontextmanager
+    async def limit(self, device_ip: str) -> AsyncIterator[None]:
+        await self.limiter(device_ip).acquire()
+        if self.global_limiter is not None:
+            await self.global_limiter.acquire()
+        yield
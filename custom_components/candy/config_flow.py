@@ -1,6 +1,7 @@
 """Config flow for GreenGo integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
 from typing import Any
 
@@ -8,6 +9,7 @@ import async_timeout
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_IP_ADDRESS, CONF_PASSWORD
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
@@ -28,39 +30,107 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_POLL
 
+    def __init__(self) -> None:
+        self._ip_address: str | None = None
+        self._detect_task: asyncio.Task[tuple[Encryption, str | None]] | None = None
+        self._errors: dict[str, str] = {}
+
     async def async_step_user(
             self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Handle the initial step."""
         if user_input is None:
-            return self.async_show_form(step_id="user", data_schema=STEP_DATA_SCHEMA)
+            return self.async_show_form(step_id="user", data_schema=STEP_DATA_SCHEMA, errors=self._errors)
 
-        config_data = {
-            CONF_IP_ADDRESS: user_input[CONF_IP_ADDRESS]
-        }
+        self._ip_address = user_input[CONF_IP_ADDRESS]
+        self._detect_task = None
+        self._errors = {}
+        return await self.async_step_detect()
+
+    async def async_step_detect(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Detect the encryption of the device, searching for the key can take a while"""
+        if self._detect_task is None:
+            self._detect_task = self.hass.async_create_task(self._async_detect_encryption())
+        if not self._detect_task.done():
+            return self.async_show_progress(
+                step_id="detect", progress_action="detect_encryption", progress_task=self._detect_task
+            )
 
-        errors = {}
         try:
-            async with async_timeout.timeout(40):
-                encryption_type, key = await detect_encryption(
-                    session=async_get_clientsession(self.hass),
-                    device_ip=user_input[CONF_IP_ADDRESS]
-                )
+            self._detect_task.result()
         except Exception as err:  # pylint: disable=broad-except
             _LOGGER.exception(err)
-            errors["base"] = "detect_encryption"
-        else:
-            if encryption_type == Encryption.ENCRYPTION:
-                config_data[CONF_KEY_USE_ENCRYPTION] = True
-                config_data[CONF_PASSWORD] = key
-            elif encryption_type == Encryption.NO_ENCRYPTION:
-                config_data[CONF_KEY_USE_ENCRYPTION] = False
-            elif encryption_type == Encryption.ENCRYPTION_WITHOUT_KEY:
-                config_data[CONF_KEY_USE_ENCRYPTION] = True
-                config_data[CONF_PASSWORD] = ""
-
-            return self.async_create_entry(title=CONF_INTEGRATION_TITLE, data=config_data)
+            self._errors["base"] = "detect_encryption"
+            return self.async_show_progress_done(next_step_id="user")
+        return self.async_show_progress_done(next_step_id="finish")
+
+    async def async_step_finish(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        encryption_type, key = self._detect_task.result()
+        config_data = {
+            CONF_IP_ADDRESS: self._ip_address
+        }
+        if encryption_type == Encryption.ENCRYPTION:
+            config_data[CONF_KEY_USE_ENCRYPTION] = True
+            config_data[CONF_PASSWORD] = key
+        elif encryption_type == Encryption.NO_ENCRYPTION:
+            config_data[CONF_KEY_USE_ENCRYPTION] = False
+        elif encryption_type == Encryption.ENCRYPTION_WITHOUT_KEY:
+            config_data[CONF_KEY_USE_ENCRYPTION] = True
+            config_data[CONF_PASSWORD] = ""
+
+        return self.async_create_entry(title=CONF_INTEGRATION_TITLE, data=config_data)
+
+    async def _async_detect_encryption(self) -> tuple[Encryption, str | None]:
+        async with async_timeout.timeout(40):
+            return await detect_encryption(
+                session=async_get_clientsession(self.hass),
+                device_ip=self._ip_address,
+                progress_callback=self._key_search_progress,
+                samples=KEY_SEARCH_SAMPLES
+            )
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: config_entries.ConfigEntry) -> OptionsFlow:
+        return OptionsFlow()
+
+    @callback
+    def _key_search_progress(self, done: int, total: int) -> None:
+        _LOGGER.info("Searched %d/%d partitions of the key space", done, total)
+        # The progress bar of the flow is only available in newer Home Assistant releases
+        if hasattr(self, "async_update_progress"):
+            self.async_update_progress(done / total)
+
+
+class OptionsFlow(config_entries.OptionsFlow):
+    """Handle the polling options of a Candy device."""
+
+    if not hasattr(config_entries.OptionsFlow, "config_entry"):
+        # Provided by the base class since Home Assistant 2024.11, setting it in the constructor is deprecated there
+        @property
+        def config_entry(self) -> config_entries.ConfigEntry:
+            return self.hass.config_entries.async_get_entry(self.handler)
+
+    async def async_step_init(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
 
+        options = self.config_entry.options
         return self.async_show_form(
-            step_id="user", data_schema=STEP_DATA_SCHEMA, errors=errors
+            step_id="init",
+            data_schema=vol.Schema({
+                vol.Required(CONF_KEY_LIVENESS_PROBE, default=options.get(CONF_KEY_LIVENESS_PROBE, False)): bool,
+                vol.Required(
+                    CONF_KEY_DEDICATED_CONNECTION, default=options.get(CONF_KEY_DEDICATED_CONNECTION, False)
+                ): bool,
+                vol.Required(
+                    CONF_KEY_STALE_WINDOW, default=options.get(CONF_KEY_STALE_WINDOW, STALE_WINDOW_DEFAULT)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=24 * 60)),
+            })
         )
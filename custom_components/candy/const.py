@@ -4,9 +4,25 @@ DOMAIN = "candy"
 PLATFORMS = ["sensor"]
 
 DATA_KEY_COORDINATOR = "coordinator"
+DATA_KEY_STORE = "store"
+DATA_KEY_SCHEDULER = "scheduler"
+
+STORAGE_KEY_REQUEST_RATE = "request_rate"
+STORAGE_KEY_USAGE_HISTOGRAM = "usage_histogram"
+STORAGE_KEY_LAST_RESPONSE = "last_response"
 
 CONF_INTEGRATION_TITLE = "Candy"
 CONF_KEY_USE_ENCRYPTION = "use_encryption"
+CONF_KEY_MACHINE_TYPE = "machine_type"
+CONF_KEY_LIVENESS_PROBE = "liveness_probe"
+CONF_KEY_DEDICATED_CONNECTION = "dedicated_connection"
+CONF_KEY_STALE_WINDOW = "stale_window"
+
+# Minutes the last status is shown for after a device stops responding, before its entities become unavailable
+STALE_WINDOW_DEFAULT = 10
+
+# Number of encrypted responses used to narrow down the key candidates when setting up a device
+KEY_SEARCH_SAMPLES = 3
 
 UNIQUE_ID_WASHING_MACHINE = "{0}-washing_machine"
 UNIQUE_ID_WASH_CYCLE_STATUS = "{0}-wash_cycle_status"
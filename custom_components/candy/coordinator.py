@@ -0,0 +1,126 @@
+"""Data update coordinator of a Candy device."""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .client import CandyClient
+from .client.model import DishwasherStatus, OvenStatus, TumbleDryerStatus, WashingMachineStatus
+from .const import DOMAIN, STORAGE_KEY_LAST_RESPONSE, STORAGE_KEY_REQUEST_RATE, STORAGE_KEY_USAGE_HISTOGRAM
+from .polling import (UPDATE_INTERVAL_DEFAULT, UPDATE_INTERVAL_TRANSITION, UsageHistogram, is_idle,
+                      next_update_interval, retry_interval)
+from .storage import CandyStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CandyDataUpdateCoordinator(
+    DataUpdateCoordinator[Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]]
+):
+    """
+    Polls a device, with the interval adapted to the state of the device and to when it's usually used.
+
+    When a poll fails, the last status is kept for `stale_window` and the device is retried less and less often.
+    Entities only become unavailable if the device doesn't respond in that time.
+    """
+
+    def __init__(self, hass: HomeAssistant, client: CandyClient, store: CandyStore,
+                 stale_window: timedelta = timedelta(0)):
+        # Polls are scheduled by CandyPollScheduler, not by the coordinator itself.
+        # Entities are only notified when the status changes.
+        super().__init__(hass, _LOGGER, name=DOMAIN, update_interval=None, always_update=False)
+        self.poll_interval = UPDATE_INTERVAL_DEFAULT
+        self.client = client
+        self.store = store
+        self.stale_window = stale_window
+        self.usage = UsageHistogram(store.data.get(STORAGE_KEY_USAGE_HISTOGRAM))
+        # The data is the status saved before the restart, until the first successful refresh
+        self.restored = False
+        # Polls failed since the last successful one
+        self.failed_polls = 0
+        # Time of the last successful poll, or of the restore, the stale window starts from it
+        self._fresh_at: Optional[datetime] = None
+
+    @property
+    def stale(self) -> bool:
+        """The data isn't the response of the last poll"""
+        return self.restored or self.failed_polls > 0
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        """Seconds since the last successful poll, unknown for a status saved in the last run"""
+        if self.restored or self._fresh_at is None:
+            return None
+        return (dt_util.utcnow() - self._fresh_at).total_seconds()
+
+    @callback
+    def async_restore(self) -> bool:
+        """Start with the status saved in the last run, if there is one"""
+        response = self.store.data.get(STORAGE_KEY_LAST_RESPONSE)
+        if response is None:
+            return False
+        try:
+            status = self.client.restore_status(response)
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.warning("Unable to restore the saved status, waiting for the device: %s", repr(err))
+            return False
+
+        self.restored = True
+        self._fresh_at = dt_util.utcnow()
+        self.async_set_updated_data(status)
+        return True
+
+    async def async_refresh(self) -> None:
+        (was_stale, previous_data, previous_success) = (self.stale, self.data, self.last_update_success)
+        await super().async_refresh()
+        if (was_stale or self.stale) and previous_success and self.last_update_success \
+                and self.data == previous_data:
+            # Listeners are only notified of changes, but the entities went stale, are still stale with a greater
+            # age, or are no longer stale
+            self.async_update_listeners()
+
+    async def _async_update_data(self) -> Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]:
+        try:
+            status = await self.client.status_with_retry()
+            _LOGGER.debug("Fetched status: %s, %.0f%% of responses unchanged", status, self.client.skip_rate * 100)
+        except Exception as err:
+            self.failed_polls += 1
+            self.poll_interval = retry_interval(self.failed_polls)
+            stale_for = self._stale_for()
+            if stale_for is None:
+                raise UpdateFailed(f"Error communicating with API: {repr(err)}") from err
+
+            # Retry before the window ends, so that entities don't stay available much longer than it
+            self.poll_interval = max(min(self.poll_interval, stale_for), UPDATE_INTERVAL_TRANSITION)
+            log = _LOGGER.warning if self.failed_polls == 1 else _LOGGER.debug
+            log("Keeping the last status for %.0f more seconds, no response from the device: %s",
+                stale_for.total_seconds(), repr(err))
+            return self.data
+        finally:
+            self.store.async_set(STORAGE_KEY_REQUEST_RATE, self.client.request_rate)
+
+        self.store.async_set(STORAGE_KEY_LAST_RESPONSE, self.client.last_response)
+
+        now = dt_util.now()
+        # A cycle started while HA wasn't running isn't recorded at the wrong hour
+        if self.data is not None and not self.restored and is_idle(self.data) and not is_idle(status):
+            self.usage.record_start(now)
+            self.store.async_set(STORAGE_KEY_USAGE_HISTOGRAM, list(self.usage.counts))
+        self.restored = False
+        self.failed_polls = 0
+        self._fresh_at = dt_util.utcnow()
+
+        self.poll_interval = next_update_interval(status, self.usage, now)
+        return status
+
+    def _stale_for(self) -> Optional[timedelta]:
+        """Time left of the stale window, None if the last status can't be kept anymore"""
+        if self.data is None or self._fresh_at is None:
+            return None
+        left = self._fresh_at + self.stale_window - dt_util.utcnow()
+        return left if left > timedelta(0) else None
@@ -0,0 +1,35 @@
+"""Diagnostics support for Candy."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.core import HomeAssistant
+
+from .const import DATA_KEY_COORDINATOR, DOMAIN
+from .coordinator import CandyDataUpdateCoordinator
+
+TO_REDACT = {CONF_PASSWORD}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, config_entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    coordinator: CandyDataUpdateCoordinator = hass.data[DOMAIN][config_entry.entry_id][DATA_KEY_COORDINATOR]
+
+    return {
+        "entry": async_redact_data(config_entry.as_dict(), TO_REDACT),
+        "request_rate": coordinator.client.request_rate,
+        "responses": coordinator.client.responses,
+        "unchanged_responses": coordinator.client.unchanged_responses,
+        "skip_rate": coordinator.client.skip_rate,
+        "circuit_breaker": coordinator.client.circuit_breaker.as_dict(),
+        "poll_interval": coordinator.poll_interval.total_seconds(),
+        "last_update_success": coordinator.last_update_success,
+        "restored": coordinator.restored,
+        "failed_polls": coordinator.failed_polls,
+        "age_seconds": coordinator.age_seconds,
+        "usage_histogram": list(coordinator.usage.counts),
+        "status": str(coordinator.data),
+    }
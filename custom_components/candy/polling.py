@@ -0,0 +1,115 @@
+"""Choice of the next poll time based on the last status of a device."""
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from .client.model import (DishwasherState, DishwasherStatus, MachineState,
+                           OvenState, OvenStatus, TumbleDryerStatus,
+                           WashingMachineStatus)
+
+UPDATE_INTERVAL_QUIET_HOURS = timedelta(minutes=15)
+UPDATE_INTERVAL_IDLE = timedelta(minutes=3)
+UPDATE_INTERVAL_DEFAULT = timedelta(seconds=60)
+UPDATE_INTERVAL_ACTIVE = timedelta(seconds=30)
+UPDATE_INTERVAL_TRANSITION = timedelta(seconds=15)
+# Longest wait between polls of a device that stopped responding
+UPDATE_INTERVAL_RETRY_MAX = timedelta(minutes=10)
+
+# A cycle with this many minutes remaining is about to end
+CYCLE_ENDING_MINUTES = 5
+
+HOURS_PER_WEEK = 7 * 24
+# The usage histogram is trusted after this many observed cycle starts
+MIN_OBSERVED_STARTS = 10
+# An hour is quiet if no cycle has been started in it, nor in the hour after it
+QUIET_LOOKAHEAD_HOURS = 2
+
+
+class UsageHistogram:
+    """Number of cycles started in each hour of the week, in local time"""
+
+    def __init__(self, counts: Optional[list[int]] = None):
+        self.counts = list(counts) if counts and len(counts) == HOURS_PER_WEEK else [0] * HOURS_PER_WEEK
+
+    def record_start(self, now: datetime) -> None:
+        self.counts[_hour_of_week(now)] += 1
+
+    def is_quiet(self, now: datetime) -> bool:
+        if sum(self.counts) < MIN_OBSERVED_STARTS:
+            return False
+        hour = _hour_of_week(now)
+        return all(self.counts[(hour + i) % HOURS_PER_WEEK] == 0 for i in range(QUIET_LOOKAHEAD_HOURS))
+
+
+def is_idle(status: Optional[Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]]) -> bool:
+    if isinstance(status, (WashingMachineStatus, TumbleDryerStatus)):
+        return status.machine_state is MachineState.IDLE
+    if isinstance(status, DishwasherStatus):
+        return status.machine_state is DishwasherState.IDLE
+    if isinstance(status, OvenStatus):
+        return status.machine_state is OvenState.IDLE
+    return False
+
+
+def is_finished(
+        status: Optional[Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]]
+) -> bool:
+    """The cycle ended, but the machine wasn't reset yet, which can last for hours if the door stays closed"""
+    if isinstance(status, (WashingMachineStatus, TumbleDryerStatus)):
+        return status.machine_state in (MachineState.FINISHED1, MachineState.FINISHED2)
+    if isinstance(status, DishwasherStatus):
+        return status.machine_state is DishwasherState.FINISHED
+    return False
+
+
+def next_update_interval(
+        status: Optional[Union[WashingMachineStatus, TumbleDryerStatus, DishwasherStatus, OvenStatus]],
+        usage: Optional[UsageHistogram] = None,
+        now: Optional[datetime] = None
+) -> timedelta:
+    """
+    Poll rarely while the device is idle or left finished, even more rarely in hours when the device is never used,
+    and frequently when a state change is expected soon, like the end of a cycle or the oven reaching the set
+    temperature.
+    """
+    if is_idle(status) or is_finished(status):
+        if usage is not None and now is not None and usage.is_quiet(now):
+            return UPDATE_INTERVAL_QUIET_HOURS
+        return UPDATE_INTERVAL_IDLE
+
+    if isinstance(status, (WashingMachineStatus, TumbleDryerStatus)):
+        if status.machine_state is MachineState.RUNNING:
+            return _running_interval(status.remaining_minutes)
+    elif isinstance(status, DishwasherStatus):
+        return _running_interval(status.remaining_minutes)
+    elif isinstance(status, OvenStatus):
+        if not status.temp_reached:
+            return UPDATE_INTERVAL_ACTIVE
+
+    return UPDATE_INTERVAL_DEFAULT
+
+
+def poll_phase(entry_id: str) -> float:
+    """
+    Fraction of the poll interval by which a device is offset from the others, the same for a config entry across
+    restarts. Spreads the polls of many devices over the interval instead of polling all of them at once.
+    """
+    digest = hashlib.sha1(entry_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def retry_interval(failed_polls: int) -> timedelta:
+    """Poll less and less often while a device doesn't respond, it's probably turned off"""
+    return min(UPDATE_INTERVAL_DEFAULT * 2 ** min(failed_polls - 1, 10), UPDATE_INTERVAL_RETRY_MAX)
+
+
+def _running_interval(remaining_minutes: int) -> timedelta:
+    if remaining_minutes <= CYCLE_ENDING_MINUTES:
+        return UPDATE_INTERVAL_TRANSITION
+    return UPDATE_INTERVAL_DEFAULT
+
+
+def _hour_of_week(now: datetime) -> int:
+    return now.weekday() * 24 + now.hour
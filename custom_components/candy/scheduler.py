@@ -0,0 +1,133 @@
+"""Shared polling of every Candy device."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_at
+
+from .coordinator import CandyDataUpdateCoordinator
+from .polling import poll_phase
+
+_LOGGER = logging.getLogger(__name__)
+
+# HTTP requests to devices in flight at the same time, the rest wait for a free slot
+MAX_CONCURRENT_REQUESTS = 4
+# Seconds after the timer within which other due entries are polled in the same wakeup, instead of another timer
+COALESCE_WINDOW = 1.0
+# Seconds over which the first refreshes of all entries are spread after a restart
+STARTUP_STAGGER = 5.0
+
+
+class CandyPollScheduler:
+    """
+    Polls the coordinators of all config entries with a single timer, instead of a timer per coordinator. The timer
+    fires when the next coordinator is due, then every coordinator that is due is refreshed.
+
+    The clients share `request_slots`, at most `max_concurrent_requests` HTTP requests are in flight at a time. A
+    refresh only holds a slot during a request, not while it waits for a rate limiter or between retries.
+
+    Each entry is polled at its own phase of the poll interval (see `poll_phase()`), so that devices with the same
+    interval don't all become due at once.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS):
+        self.hass = hass
+        self.polls = 0
+        self.wakeups = 0
+        self.request_slots = asyncio.Semaphore(max_concurrent_requests)
+        self._entries: dict[str, ConfigEntry] = {}
+        self._coordinators: dict[str, CandyDataUpdateCoordinator] = {}
+        # Loop time when each entry is due to be polled next
+        self._due: dict[str, float] = {}
+        self._polling: set[str] = set()
+        self._unsub_timer: Optional[CALLBACK_TYPE] = None
+        self._timer_at: Optional[float] = None
+
+    @callback
+    def async_add(
+            self, config_entry: ConfigEntry, coordinator: CandyDataUpdateCoordinator, refresh_soon: bool = False
+    ) -> None:
+        """
+        Start polling a coordinator after its first refresh, or if `refresh_soon`, do the first refresh in the
+        background after the startup delay of the entry.
+        """
+        entry_id = config_entry.entry_id
+        self._entries[entry_id] = config_entry
+        self._coordinators[entry_id] = coordinator
+        if refresh_soon:
+            self._due[entry_id] = self.hass.loop.time() + self.startup_delay(entry_id)
+        else:
+            self._due[entry_id] = self._next_due(entry_id, coordinator.poll_interval)
+        self._schedule()
+
+    @staticmethod
+    def startup_delay(entry_id: str) -> float:
+        """Seconds to wait before the first refresh of an entry, in the same order as the phases of the entries"""
+        return poll_phase(entry_id) * STARTUP_STAGGER
+
+    @callback
+    def async_remove(self, entry_id: str) -> None:
+        self._entries.pop(entry_id, None)
+        self._coordinators.pop(entry_id, None)
+        self._due.pop(entry_id, None)
+        self._schedule()
+
+    @callback
+    def _schedule(self) -> None:
+        """Set the timer to the earliest due time of the entries that aren't being polled"""
+        waiting = [due for (entry_id, due) in self._due.items() if entry_id not in self._polling]
+        next_at = min(waiting) if waiting else None
+        if next_at == self._timer_at:
+            return
+
+        if self._unsub_timer is not None:
+            self._unsub_timer()
+            self._unsub_timer = None
+        self._timer_at = next_at
+        if next_at is not None:
+            self._unsub_timer = async_call_at(self.hass, self._on_timer, next_at)
+
+    @callback
+    def _on_timer(self, _now: datetime) -> None:
+        # The timer fires at the time it was set to, even if the loop clock is behind it (like in tests)
+        fired_at = max(self.hass.loop.time(), self._timer_at or 0)
+        self._unsub_timer = None
+        self._timer_at = None
+        self.wakeups += 1
+
+        for (entry_id, due) in list(self._due.items()):
+            if due <= fired_at + COALESCE_WINDOW and entry_id not in self._polling:
+                self._polling.add(entry_id)
+                self._entries[entry_id].async_create_task(
+                    self.hass, self._poll(entry_id), f"candy poll {entry_id}"
+                )
+        self._schedule()
+
+    async def _poll(self, entry_id: str) -> None:
+        coordinator = self._coordinators[entry_id]
+        try:
+            await coordinator.async_refresh()
+            self.polls += 1
+        finally:
+            self._polling.discard(entry_id)
+            # The entry might have been unloaded in the meantime
+            if entry_id in self._due:
+                self._due[entry_id] = self._next_due(entry_id, coordinator.poll_interval)
+            self._schedule()
+
+    def _next_due(self, entry_id: str, interval: timedelta) -> float:
+        """
+        Next loop time at the phase of the entry, between half and one and a half intervals from now. A device is
+        never polled more than twice as often as its interval, even right after it was polled early by coalescing.
+        """
+        now = self.hass.loop.time()
+        seconds = interval.total_seconds()
+        due = now + (poll_phase(entry_id) * seconds - now) % seconds
+        if due - now < seconds / 2:
+            due += seconds
+        return due
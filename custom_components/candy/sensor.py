@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.config_entries import ConfigEntry
@@ -10,14 +10,14 @@ from homeassistant.const import (
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.typing import StateType
-from homeassistant.helpers.update_coordinator import (CoordinatorEntity,
-                                                      DataUpdateCoordinator)
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from .client import WashingMachineStatus
+from .client import STATUS_TYPES, WashingMachineStatus
 from .client.model import (DishwasherState, DishwasherStatus,
                            DryerProgramState, MachineState, OvenStatus,
                            TumbleDryerStatus)
 from .const import *
+from .coordinator import CandyDataUpdateCoordinator
 
 
 async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry, async_add_entities):
@@ -25,35 +25,37 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry, asyn
 
     config_id = config_entry.entry_id
     coordinator = hass.data[DOMAIN][config_id][DATA_KEY_COORDINATOR]
+    # Known from the config entry or from the first response, entities don't depend on the status itself
+    status_type = STATUS_TYPES.get(coordinator.client.status_key)
 
-    if isinstance(coordinator.data, WashingMachineStatus):
+    if status_type is WashingMachineStatus:
         async_add_entities([
             CandyWashingMachineSensor(coordinator, config_id),
             CandyWashCycleStatusSensor(coordinator, config_id),
             CandyWashRemainingTimeSensor(coordinator, config_id)
         ])
-    elif isinstance(coordinator.data, TumbleDryerStatus):
+    elif status_type is TumbleDryerStatus:
         async_add_entities([
             CandyTumbleDryerSensor(coordinator, config_id),
             CandyTumbleStatusSensor(coordinator, config_id),
             CandyTumbleRemainingTimeSensor(coordinator, config_id)
         ])
-    elif isinstance(coordinator.data, OvenStatus):
+    elif status_type is OvenStatus:
         async_add_entities([
             CandyOvenSensor(coordinator, config_id),
             CandyOvenTempSensor(coordinator, config_id)
         ])
-    elif isinstance(coordinator.data, DishwasherStatus):
+    elif status_type is DishwasherStatus:
         async_add_entities([
             CandyDishwasherSensor(coordinator, config_id),
             CandyDishwasherRemainingTimeSensor(coordinator, config_id)
         ])
     else:
-        raise Exception(f"Unable to determine machine type: {coordinator.data}")
+        raise Exception(f"Unable to determine machine type: {coordinator.client.status_key}")
 
 
 class CandyBaseSensor(CoordinatorEntity, SensorEntity):
-    def __init__(self, coordinator: DataUpdateCoordinator, config_id: str):
+    def __init__(self, coordinator: CandyDataUpdateCoordinator, config_id: str):
         super().__init__(coordinator)
         self.config_id = config_id
 
@@ -74,6 +76,20 @@ class CandyBaseSensor(CoordinatorEntity, SensorEntity):
     def suggested_area(self) -> str:
         pass
 
+    def status_attributes(self) -> dict[str, Any]:
+        """Attributes from the status of the device"""
+        return {}
+
+    @property
+    def extra_state_attributes(self) -> Optional[Mapping[str, Any]]:
+        attributes = self.status_attributes()
+        if self.coordinator.stale:
+            # Saved before the restart, or kept after the device stopped responding
+            attributes["stale"] = True
+            if self.coordinator.age_seconds is not None:
+                attributes["age_seconds"] = round(self.coordinator.age_seconds)
+        return attributes or None
+
 
 class CandyWashingMachineSensor(CandyBaseSensor):
 
@@ -100,8 +116,7 @@ class CandyWashingMachineSensor(CandyBaseSensor):
     def icon(self) -> str:
         return "mdi:washing-machine"
 
-    @property
-    def extra_state_attributes(self) -> Mapping[str, Any]:
+    def status_attributes(self) -> dict[str, Any]:
         status: WashingMachineStatus = self.coordinator.data
 
         attributes = {
@@ -206,8 +221,7 @@ class CandyTumbleDryerSensor(CandyBaseSensor):
     def icon(self) -> str:
         return "mdi:tumble-dryer"
 
-    @property
-    def extra_state_attributes(self) -> Mapping[str, Any]:
+    def status_attributes(self) -> dict[str, Any]:
         status: TumbleDryerStatus = self.coordinator.data
 
         attributes = {
@@ -312,8 +326,7 @@ class CandyOvenSensor(CandyBaseSensor):
     def icon(self) -> str:
         return "mdi:stove"
 
-    @property
-    def extra_state_attributes(self) -> Mapping[str, Any]:
+    def status_attributes(self) -> dict[str, Any]:
         status: OvenStatus = self.coordinator.data
 
         attributes = {
@@ -385,8 +398,7 @@ class CandyDishwasherSensor(CandyBaseSensor):
     def icon(self) -> str:
         return "mdi:glass-wine"
 
-    @property
-    def extra_state_attributes(self) -> Mapping[str, Any]:
+    def status_attributes(self) -> dict[str, Any]:
         status: DishwasherStatus = self.coordinator.data
 
         attributes = {
@@ -0,0 +1,33 @@
+"""Persistent state of a Candy device that survives restarts."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+
+STORAGE_VERSION = 1
+# Seconds to wait before writing, changes in the meantime are batched into one write
+STORAGE_SAVE_DELAY = 60
+
+
+class CandyStore:
+    """Learned, per config entry state, saved to .storage/candy.<entry_id>"""
+
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        self._store: Store[dict[str, Any]] = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}")
+        self.data: dict[str, Any] = {}
+
+    async def async_load(self) -> None:
+        self.data = await self._store.async_load() or {}
+
+    def async_set(self, key: str, value: Any) -> None:
+        """Update a value and schedule a save if it changed"""
+        if self.data.get(key) != value:
+            self.data[key] = value
+            self._store.async_delay_save(lambda: self.data, STORAGE_SAVE_DELAY)
+
+    async def async_remove(self) -> None:
+        await self._store.async_remove()
@@ -1,10 +1,15 @@
+import json
+from typing import Optional
+
 from homeassistant.const import CONF_IP_ADDRESS, CONF_PASSWORD
 from homeassistant.core import HomeAssistant
-from pytest_homeassistant_custom_component.common import MockConfigEntry
+from pytest_homeassistant_custom_component.common import MockConfigEntry, load_fixture
 
 from custom_components.candy import DOMAIN, CONF_KEY_USE_ENCRYPTION
+from custom_components.candy.client.decryption import decrypt
 
 TEST_IP = "192.168.0.66"
+TEST_ENTRY_ID = "test-entry-id"
 TEST_ENCRYPTION_KEY_EMPTY = ""
 TEST_ENCRYPTION_KEY = "fbfjlbmmfklfaikm"
 TEST_ENCRYPTED_HEX_RESPONSE = """
@@ -15,15 +20,18 @@ TEST_UNENCRYPTED_HEX_RESPONSE = """
 """
 
 
-async def init_integration(hass: HomeAssistant, aioclient_mock, status_response: str):
+async def init_integration(hass: HomeAssistant, aioclient_mock, status_response: str, entry_id: str = TEST_ENTRY_ID,
+                           options: Optional[dict] = None):
     entry = MockConfigEntry(
         domain=DOMAIN,
+        entry_id=entry_id,
         unique_id="123-456",
         data={
             CONF_IP_ADDRESS: "192.168.0.66",
             CONF_KEY_USE_ENCRYPTION: False,
             CONF_PASSWORD: "",
-        }
+        },
+        options=options or {},
     )
 
     aioclient_mock.get(f"http://{TEST_IP}/http-read.json?encrypted=0", text=status_response)
@@ -31,3 +39,17 @@ async def init_integration(hass: HomeAssistant, aioclient_mock, status_response:
     entry.add_to_hass(hass)
     await hass.config_entries.async_setup(entry.entry_id)
     await hass.async_block_till_done()
+
+    return entry
+
+
+def format_like_device(status: dict) -> bytes:
+    """Serialize a status response with the whitespace the devices use"""
+    return json.dumps(status, indent="\t", separators=(",", ":")).replace("\n", "\r\n").encode()
+
+
+def encrypted_fixture(fixture: str, key: str) -> bytes:
+    """Format a JSON fixture the way devices do, then encrypt it with the given key"""
+    plaintext = format_like_device(json.loads(load_fixture(fixture)))
+    # XOR encryption is symmetric
+    return decrypt(key.encode(), plaintext)
@@ -14,11 +14,12 @@
 #
 # See here for more info: https://docs.pytest.org/en/latest/fixture.html (note that
 # pytest includes fixtures OOB which you can use as defined on this page)
-from unittest.mock import patch
-from aiolimiter import AsyncLimiter
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from custom_components.candy.client.ratelimit import RateLimiterRegistry
+
 pytest_plugins = "pytest_homeassistant_custom_component"
 
 
@@ -42,5 +43,20 @@ def skip_notifications_fixture():
 
 @pytest.fixture(name="disable_api_rate_limiter", autouse=True)
 def disable_api_rate_limiter():
-    with patch("custom_components.candy.client._LIMITER"):
-        yield AsyncLimiter(max_rate=1000, time_period=1)
\ No newline at end of file
+    limiters = RateLimiterRegistry(initial_rate=1000, max_rate=1000)
+    with patch("custom_components.candy.client._LIMITERS", limiters):
+        yield limiters
+
+# Devices in tests are mocked at the HTTP level, there is nothing to accept TCP connections
+@pytest.fixture(name="disable_liveness_probe", autouse=True)
+def disable_liveness_probe():
+    probe = MagicMock()
+    probe.return_value.is_alive = AsyncMock(return_value=True)
+    with patch("custom_components.candy.client.LivenessProbe", probe):
+        yield probe
+
+# Tests set up one entry at a time, there is no fan-out to spread
+@pytest.fixture(name="disable_startup_stagger", autouse=True)
+def disable_startup_stagger():
+    with patch("custom_components.candy.scheduler.STARTUP_STAGGER", 0):
+        yield
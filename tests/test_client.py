@@ -1,9 +1,28 @@
+import asyncio
+import tracemalloc
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiohttp
 import pytest
+from aiolimiter import AsyncLimiter
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from pytest_homeassistant_custom_component.common import load_fixture
-
-from custom_components.candy.client import (CandyClient, Encryption,
+from pytest_homeassistant_custom_component.test_util.aiohttp import \
+    AiohttpClientMockResponse
+
+from custom_components.candy.client import (MIN_ATTEMPT_TIME,
+                                            BadRequestError, CandyClient,
+                                            CircuitOpenError, CircuitState,
+                                            Encryption, RateLimiterRegistry,
+                                            _expo_until, create_device_session,
                                             detect_encryption)
+from custom_components.candy.client import jsonbackend
+from custom_components.candy.client.decryption import decrypt
+from custom_components.candy.client.liveness import (DeviceUnreachableError,
+                                                     LivenessProbe)
+from custom_components.candy.client.circuitbreaker import (FAILURE_THRESHOLD,
+                                                           OPEN_DURATION,
+                                                           CircuitBreaker)
 from custom_components.candy.client.model import (DishwasherStatus,
                                                   MachineState,
                                                   WashingMachineStatus,
@@ -96,6 +115,65 @@ async def test_detect_encryption_key(hass, aioclient_mock):
     assert key == TEST_ENCRYPTION_KEY
 
 
+async def test_detect_encryption_key_multiple_samples(hass, aioclient_mock):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=0",
+        json={"response": "BAD REQUEST"}
+    )
+
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=1",
+        text=TEST_ENCRYPTED_HEX_RESPONSE
+    )
+
+    encryption_type, key = await detect_encryption(async_get_clientsession(hass), TEST_IP, samples=3)
+
+    # The key is found from the known plaintext, more samples aren't needed
+    assert encryption_type is Encryption.ENCRYPTION
+    assert key == TEST_ENCRYPTION_KEY
+    assert aioclient_mock.call_count == 2
+
+
+async def test_detect_encryption_skips_invalid_samples(hass, aioclient_mock):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=0",
+        json={"response": "BAD REQUEST"}
+    )
+    other_response = encrypted_fixture("washing_machine/idle.json", TEST_ENCRYPTION_KEY)
+    responses = iter([TEST_ENCRYPTED_HEX_RESPONSE, '{"response":"BAD REQUEST"}', "not hex", other_response.hex()])
+
+    async def next_response(method, url, data):
+        return AiohttpClientMockResponse(method, url, text=next(responses))
+
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json?encrypted=1", side_effect=next_response)
+    find_key = AsyncMock(side_effect=[None, TEST_ENCRYPTION_KEY])
+
+    with patch("custom_components.candy.client.find_key_in_pool", find_key):
+        encryption_type, key = await detect_encryption(async_get_clientsession(hass), TEST_IP, samples=4)
+
+    assert (encryption_type, key) == (Encryption.ENCRYPTION, TEST_ENCRYPTION_KEY)
+    assert aioclient_mock.call_count == 5
+    assert find_key.call_args_list[0].kwargs == {"exhaustive": False}
+    assert find_key.call_args_list[1].kwargs["additional_responses"] == [other_response]
+    assert find_key.call_args_list[1].kwargs["known_plaintext"]
+
+
+async def test_detect_encryption_identical_samples(hass, aioclient_mock):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=0",
+        json={"response": "BAD REQUEST"}
+    )
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json?encrypted=1", text=TEST_ENCRYPTED_HEX_RESPONSE)
+    find_key = AsyncMock(side_effect=[None, TEST_ENCRYPTION_KEY])
+
+    with patch("custom_components.candy.client.find_key_in_pool", find_key):
+        await detect_encryption(async_get_clientsession(hass), TEST_IP, samples=3)
+
+    # Nothing was narrowed down, the known plaintext search would only repeat itself
+    assert find_key.call_args_list[1].kwargs["additional_responses"] == []
+    assert not find_key.call_args_list[1].kwargs["known_plaintext"]
+
+
 async def test_detect_encryption_without_key(hass, aioclient_mock):
     aioclient_mock.get(
         f"http://{TEST_IP}/http-read.json?encrypted=0",
@@ -137,3 +215,335 @@ async def test_status_encryption_without_key(hass, aioclient_mock):
     status = await client.status()
 
     assert isinstance(status, WashingMachineStatus)
+
+
+async def test_rate_limiter_per_device():
+    limiters = RateLimiterRegistry(initial_rate=1 / 3)
+
+    async def request(device_ip: str):
+        async with limiters.limit(device_ip):
+            pass
+
+    await request("192.168.0.1")
+    # Another device isn't limited by the first one
+    await asyncio.wait_for(request("192.168.0.2"), timeout=0.1)
+    # The same device has to wait
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(request("192.168.0.1"), timeout=0.1)
+
+
+async def test_rate_limiter_global_cap():
+    limiters = RateLimiterRegistry(initial_rate=1 / 3, global_limiter=AsyncLimiter(max_rate=1, time_period=3))
+
+    async def request(device_ip: str):
+        async with limiters.limit(device_ip):
+            pass
+
+    await request("192.168.0.1")
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(request("192.168.0.2"), timeout=0.1)
+
+
+async def test_bad_request_decreases_rate(hass, aioclient_mock, disable_api_rate_limiter):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json",
+        json={"response": "BAD REQUEST"}
+    )
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False,
+        request_rate=100
+    )
+    with pytest.raises(BadRequestError):
+        await client.status()
+
+    assert client.request_rate == 50
+    assert disable_api_rate_limiter.limiter(TEST_IP).rate == 50
+
+
+async def test_bad_request_encrypted(hass, aioclient_mock):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json",
+        json={"response": "BAD REQUEST"}
+    )
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY, use_encryption=True,
+        request_rate=100
+    )
+    with pytest.raises(BadRequestError):
+        await client.status()
+
+    assert client.request_rate == 50
+
+
+async def test_success_increases_rate(hass, aioclient_mock):
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json",
+        text=load_fixture("washing_machine/idle.json")
+    )
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False,
+        request_rate=100
+    )
+    await client.status()
+    # The first request didn't have to wait for the limiter
+    assert client.request_rate == 100
+
+    await client.status()
+    assert client.request_rate > 100
+
+
+async def test_restored_rate_clamped(hass, disable_api_rate_limiter):
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False,
+        request_rate=0
+    )
+
+    assert client.request_rate == disable_api_rate_limiter.min_rate
+
+
+async def test_retries_stop_at_deadline(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", exc=aiohttp.ClientConnectionError())
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await client.status_with_retry(timeout=2.5)
+
+    assert loop.time() - started < 2.5
+    assert aioclient_mock.call_count > 1
+    assert client.circuit_breaker.failures == 1
+
+
+async def test_retry_backoff_capped_by_deadline():
+    loop = asyncio.get_running_loop()
+    waits = _expo_until(loop.time() + MIN_ATTEMPT_TIME + 1.5)
+    next(waits)
+
+    # Exponential at first, then never past the last point where another attempt still fits
+    assert next(waits) == 1
+    assert [next(waits) for _ in range(3)] == pytest.approx([1.5, 1.5, 1.5], abs=0.1)
+
+
+async def test_circuit_opens_after_failures(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", exc=aiohttp.ClientConnectionError())
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    for _ in range(FAILURE_THRESHOLD):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await client.status_with_retry(timeout=0.1)
+    assert client.circuit_breaker.state is CircuitState.OPEN
+
+    # Fails fast without making a request
+    aioclient_mock.clear_requests()
+    with pytest.raises(CircuitOpenError):
+        await client.status_with_retry()
+    assert aioclient_mock.call_count == 0
+
+
+async def test_circuit_half_open_probe(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("washing_machine/idle.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    for _ in range(FAILURE_THRESHOLD):
+        client.circuit_breaker.on_failure()
+
+    with patch("time.monotonic", return_value=client.circuit_breaker._opened_at + OPEN_DURATION):
+        status = await client.status_with_retry()
+
+    assert isinstance(status, WashingMachineStatus)
+    assert client.circuit_breaker.state is CircuitState.CLOSED
+
+
+async def test_circuit_half_open_probe_bad_request(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", json={"response": "BAD REQUEST"})
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    for _ in range(FAILURE_THRESHOLD):
+        client.circuit_breaker.on_failure()
+
+    with patch("time.monotonic", return_value=client.circuit_breaker._opened_at + OPEN_DURATION):
+        with pytest.raises(BadRequestError):
+            await client.status_with_retry()
+
+    assert client.circuit_breaker.state is CircuitState.OPEN
+    assert client.circuit_breaker.open_duration == OPEN_DURATION * 2
+
+
+def test_circuit_failed_probe_backs_off():
+    breaker = CircuitBreaker()
+    for _ in range(FAILURE_THRESHOLD):
+        breaker.on_failure()
+    assert not breaker.allow_request()
+
+    with patch("time.monotonic", return_value=breaker._opened_at + OPEN_DURATION):
+        assert breaker.allow_request()
+        assert breaker.state is CircuitState.HALF_OPEN
+        breaker.on_failure()
+
+    assert breaker.state is CircuitState.OPEN
+    assert breaker.open_duration == OPEN_DURATION * 2
+
+    breaker.on_success()
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.open_duration == OPEN_DURATION
+
+
+async def test_liveness_probe_reachable(socket_enabled):
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        assert await LivenessProbe(f"127.0.0.1:{port}").is_alive()
+
+
+async def test_liveness_probe_unreachable(hass, aioclient_mock, socket_enabled):
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    aioclient_mock.get(f"http://127.0.0.1:{port}/http-read.json", text=load_fixture("washing_machine/idle.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=f"127.0.0.1:{port}", encryption_key=TEST_ENCRYPTION_KEY_EMPTY,
+        use_encryption=False
+    )
+    client.liveness_probe = LivenessProbe(client.device_ip)
+
+    # Fails without retries and without an HTTP request
+    with pytest.raises(DeviceUnreachableError):
+        await client.status_with_retry()
+    assert aioclient_mock.call_count == 0
+    assert client.circuit_breaker.failures == 1
+
+
+async def test_liveness_probe_timeout_inconclusive():
+    probe = LivenessProbe(TEST_IP)
+
+    with patch("asyncio.open_connection", side_effect=TimeoutError):
+        assert await probe.is_alive() is None
+    with patch("asyncio.open_connection", side_effect=ConnectionRefusedError):
+        assert await probe.is_alive() is False
+
+
+async def test_liveness_probe_skipped_with_open_connection(hass, aioclient_mock, disable_liveness_probe):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("washing_machine/idle.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False,
+        liveness_probe=True, keepalive_timeout=60
+    )
+    await client.status()
+    await client.status()
+
+    # The second request reuses the kept-alive connection of the first one
+    assert disable_liveness_probe.return_value.is_alive.await_count == 1
+    assert aioclient_mock.call_count == 2
+
+
+async def test_dedicated_session_reuses_connection(socket_enabled):
+    connections = 0
+    body = load_fixture("washing_machine/idle.json").encode()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        nonlocal connections
+        connections += 1
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n\r\n%s"
+                             % (len(body), body))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            # Client closed the connection
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server, create_device_session() as session:
+        client = CandyClient(session, device_ip=f"127.0.0.1:{port}", encryption_key=TEST_ENCRYPTION_KEY_EMPTY,
+                             use_encryption=False)
+        for _ in range(3):
+            assert isinstance(await client.status(), WashingMachineStatus)
+
+    assert connections == 1
+
+
+async def test_unchanged_response_skips_parsing(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("washing_machine/idle.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    status = await client.status()
+    with patch.object(WashingMachineStatus, "from_json") as from_json:
+        assert await client.status() is status
+    from_json.assert_not_called()
+
+    aioclient_mock.clear_requests()
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("washing_machine/running_wash.json"))
+    assert await client.status() != status
+
+    assert client.responses == 3
+    assert client.unchanged_responses == 1
+    assert client.skip_rate == pytest.approx(1 / 3)
+
+
+def test_decode_allocations():
+    """Decoding an encrypted response allocates the decoded hex, but no further copies of the response"""
+    # Large enough that the fixed size allocations don't matter
+    encrypted = bytes(range(256)) * 256
+    body = encrypted.hex().upper().encode()
+    client = CandyClient(MagicMock(), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY, use_encryption=True)
+    expected = decrypt(TEST_ENCRYPTION_KEY.encode(), encrypted)
+
+    # The first response allocates the reused buffer and caches the keystream
+    assert client._decode(body) == expected
+
+    tracemalloc.start()
+    try:
+        decoded = client._decode(body)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert decoded == expected
+    assert peak < len(encrypted) * 1.1
+
+
+async def test_machine_type_detected_once(hass, aioclient_mock):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("dishwasher/idle.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False,
+        status_key="statusLavatrice"
+    )
+    # The remembered type doesn't match the response, so it's detected again
+    assert isinstance(await client.status(), DishwasherStatus)
+    assert client.status_key == "statusDWash"
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+async def test_json_backends(hass, aioclient_mock, use_orjson):
+    aioclient_mock.get(f"http://{TEST_IP}/http-read.json", text=load_fixture("washing_machine/running_wash.json"))
+
+    client = CandyClient(
+        async_get_clientsession(hass), device_ip=TEST_IP, encryption_key=TEST_ENCRYPTION_KEY_EMPTY, use_encryption=False
+    )
+    with patch("custom_components.candy.client.jsonbackend.orjson", jsonbackend.orjson if use_orjson else None):
+        status = await client.status()
+        with pytest.raises(jsonbackend.JSONDecodeError):
+            jsonbackend.loads(b'{"statusLavatrice":')
+
+    assert status.machine_state is MachineState.RUNNING
@@ -3,8 +3,10 @@ from unittest.mock import patch
 import pytest
 from homeassistant import config_entries, data_entry_flow
 from homeassistant.const import CONF_IP_ADDRESS, CONF_PASSWORD
+from pytest_homeassistant_custom_component.common import MockConfigEntry
 
-from custom_components.candy import DOMAIN, CONF_KEY_USE_ENCRYPTION
+from custom_components.candy import (DOMAIN, CONF_KEY_DEDICATED_CONNECTION, CONF_KEY_LIVENESS_PROBE,
+                                     CONF_KEY_STALE_WINDOW, CONF_KEY_USE_ENCRYPTION)
 from custom_components.candy.client import Encryption
 
 
@@ -57,6 +59,16 @@ def detect_encryption_without_key_fixture():
         yield
 
 
+async def _submit_ip_address(hass, flow_id: str) -> data_entry_flow.FlowResult:
+    """Submit the user step, then continue the flow once detecting the encryption is done"""
+    result = await hass.config_entries.flow.async_configure(flow_id, user_input={CONF_IP_ADDRESS: "192.168.0.66"})
+    assert result["type"] == data_entry_flow.FlowResultType.SHOW_PROGRESS
+    assert result["progress_action"] == "detect_encryption"
+
+    await hass.async_block_till_done()
+    return await hass.config_entries.flow.async_configure(flow_id)
+
+
 async def test_no_encryption_detected(hass, detect_no_encryption): # pylint: disable=unused-argument
     """Test a successful config flow when detected encryption is no encryption."""
 
@@ -69,9 +81,7 @@ async def test_no_encryption_detected(hass, detect_no_encryption): # pylint: dis
     assert result["type"] == data_entry_flow.FlowResultType.FORM
     assert result["step_id"] == "user"
 
-    result = await hass.config_entries.flow.async_configure(
-        result["flow_id"], user_input={CONF_IP_ADDRESS: "192.168.0.66"}
-    )
+    result = await _submit_ip_address(hass, result["flow_id"])
 
     # Check that the config flow is complete and a new entry is created with
     # the input data
@@ -96,9 +106,7 @@ async def test_detected_encryption_and_key_found(hass, detect_encryption_find_ke
     assert result["type"] == data_entry_flow.FlowResultType.FORM
     assert result["step_id"] == "user"
 
-    result = await hass.config_entries.flow.async_configure(
-        result["flow_id"], user_input={CONF_IP_ADDRESS: "192.168.0.66"}
-    )
+    result = await _submit_ip_address(hass, result["flow_id"])
 
     # Check that the config flow is complete and a new entry is created with
     # the input data
@@ -123,12 +131,10 @@ async def test_detected_encryption_and_key_not_found(hass, detect_encryption_key
     assert result["type"] == data_entry_flow.FlowResultType.FORM
     assert result["step_id"] == "user"
 
-    result = await hass.config_entries.flow.async_configure(
-        result["flow_id"], user_input={CONF_IP_ADDRESS: "192.168.0.66"}
-    )
+    result = await _submit_ip_address(hass, result["flow_id"])
 
     assert result["type"] == data_entry_flow.FlowResultType.FORM
-
+    assert result["step_id"] == "user"
     assert result["errors"] == {"base": "detect_encryption"}
 
 
@@ -143,9 +149,7 @@ async def test_detected_encryption_without_key(hass, detect_encryption_without_k
     assert result["type"] == data_entry_flow.FlowResultType.FORM
     assert result["step_id"] == "user"
 
-    result = await hass.config_entries.flow.async_configure(
-        result["flow_id"], user_input={CONF_IP_ADDRESS: "192.168.0.66"}
-    )
+    result = await _submit_ip_address(hass, result["flow_id"])
 
     # Check that the config flow is complete and a new entry is created with
     # the input data
@@ -157,3 +161,26 @@ async def test_detected_encryption_without_key(hass, detect_encryption_without_k
         CONF_PASSWORD: ""
     }
     assert result["result"]
+
+
+async def test_options_flow(hass):
+    """Test changing the polling options of a device."""
+    entry = MockConfigEntry(domain=DOMAIN, data={CONF_IP_ADDRESS: "192.168.0.66", CONF_KEY_USE_ENCRYPTION: False})
+    entry.add_to_hass(hass)
+
+    result = await hass.config_entries.options.async_init(entry.entry_id)
+
+    assert result["type"] == data_entry_flow.FlowResultType.FORM
+    assert result["step_id"] == "init"
+    # The probe costs an extra connection per poll, it's only worth it for devices that are often switched off
+    assert result["data_schema"]({})[CONF_KEY_LIVENESS_PROBE] is False
+
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"],
+        user_input={CONF_KEY_LIVENESS_PROBE: True, CONF_KEY_DEDICATED_CONNECTION: True, CONF_KEY_STALE_WINDOW: 30}
+    )
+
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert entry.options == {
+        CONF_KEY_LIVENESS_PROBE: True, CONF_KEY_DEDICATED_CONNECTION: True, CONF_KEY_STALE_WINDOW: 30
+    }
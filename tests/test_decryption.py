@@ -1,5 +1,33 @@
  # pylint: disable=line-too-long
-from custom_components.candy.client.decryption import find_key
+import asyncio
+import itertools
+import math
+import multiprocessing
+import threading
+import timeit
+from unittest.mock import patch
+
+import pytest
+
+from custom_components.candy.client import decryption
+from custom_components.candy.client.decryption import (KEY_CHARSET_CODEPOINTS,
+                                                       KEY_LEN,
+                                                       PLAINTEXT_CHARSET_CODEPOINTS,
+                                                       _find_candidate_key_codepoints,
+                                                       _find_candidate_keys,
+                                                       _find_key_in_candidates,
+                                                       _find_key_with_known_plaintext,
+                                                       _init_search_worker,
+                                                       _is_json_prefix,
+                                                       _iter_keys_by_rank,
+                                                       _partition_key_space,
+                                                       _rank_candidates,
+                                                       decrypt,
+                                                       find_key,
+                                                       find_key_in_pool)
+
+from .common import (TEST_ENCRYPTED_HEX_RESPONSE, TEST_ENCRYPTION_KEY,
+                     encrypted_fixture)
 
 
 def test_find_key_1():
@@ -27,3 +55,208 @@ def test_find_key_error():
     key = find_key(response)
 
     assert key is None
+
+
+def test_partition_key_space():
+    candidates = _find_candidate_keys(bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE))
+
+    partitions = _partition_key_space(candidates, 8)
+
+    assert len(partitions) >= 8
+    keys = [key for partition in partitions for key in itertools.product(*partition)]
+    assert sorted(keys) == sorted(itertools.product(*candidates))
+
+
+async def test_find_key_in_pool():
+    progress = []
+    threads_before = set(threading.enumerate())
+
+    with patch("custom_components.candy.client.decryption.PROCESS_POOL_MIN_KEYS", 0):
+        key = await find_key_in_pool(
+            bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE),
+            progress_callback=lambda done, total: progress.append((done, total)),
+            known_plaintext=False
+        )
+
+    assert key == TEST_ENCRYPTION_KEY
+    assert progress
+    assert all(done <= total for (done, total) in progress)
+
+    # The pool isn't waited for, but the workers stop searching and exit shortly
+    for thread in set(threading.enumerate()) - threads_before:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+
+async def test_find_key_in_pool_known_plaintext_in_pool():
+    progress = []
+    threads_before = set(threading.enumerate())
+
+    # Every constrained key space counts as large
+    with patch("custom_components.candy.client.decryption.PROCESS_POOL_MIN_KEYS", 0):
+        key = await find_key_in_pool(
+            bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE),
+            progress_callback=lambda done, total: progress.append((done, total)),
+            exhaustive=False
+        )
+
+    assert key == TEST_ENCRYPTION_KEY
+    assert progress
+
+    for thread in set(threading.enumerate()) - threads_before:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+
+async def test_find_key_in_pool_cancelled():
+    # Short response of an unknown appliance type, the generic prefix leaves millions of keys to test
+    response = decryption.decrypt(
+        TEST_ENCRYPTION_KEY.encode(), b'{\r\n\t"statusFrigo":{\r\n\t\t"Temp":"4",\r\n\t\t"Door":"0",\r\n\t\t"Mode":"2"'
+    )
+    stopped = threading.Event()
+    search = decryption._find_key_in_candidates
+
+    def search_until_stopped(*args):
+        try:
+            return search(*args)
+        finally:
+            stopped.set()
+
+    with patch("custom_components.candy.client.decryption.PROCESS_POOL_MIN_KEYS", math.inf), \
+            patch("custom_components.candy.client.decryption._find_key_in_candidates",
+                  side_effect=search_until_stopped):
+        task = asyncio.create_task(find_key_in_pool(response, exhaustive=False))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The search thread isn't waited for, but it stops shortly
+        assert stopped.wait(timeout=5)
+
+
+def test_search_worker_stops():
+    response = bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE)
+    candidates = _find_candidate_keys(response)
+    stop_event = multiprocessing.get_context("spawn").Event()
+    stop_event.set()
+
+    _init_search_worker(stop_event)
+    try:
+        assert _find_key_in_candidates(response, candidates) is None
+    finally:
+        _init_search_worker(None)
+    assert _find_key_in_candidates(response, candidates) == TEST_ENCRYPTION_KEY
+
+
+def test_find_key_known_plaintext():
+    response = bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE)
+
+    key = _find_key_with_known_plaintext(response, _find_candidate_keys(response))
+
+    assert key == TEST_ENCRYPTION_KEY
+
+
+def test_find_key_known_plaintext_unknown_envelope():
+    # Same ciphertext, but the first bytes don't decrypt to a known envelope
+    response = bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE)
+    response = bytes([response[0] ^ 0x01]) + response[1:]
+
+    assert _find_key_with_known_plaintext(response, _find_candidate_keys(response)) is None
+
+
+def test_find_key_without_known_plaintext():
+    key = find_key(bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE), known_plaintext=False)
+
+    assert key == TEST_ENCRYPTION_KEY
+
+
+def test_candidate_keys_multiple_responses():
+    response = encrypted_fixture("washing_machine/idle.json", TEST_ENCRYPTION_KEY)
+    additional_responses = [
+        encrypted_fixture("washing_machine/running_wash.json", TEST_ENCRYPTION_KEY),
+        encrypted_fixture("washing_machine/delayed_start_wait.json", TEST_ENCRYPTION_KEY),
+    ]
+
+    single = _find_candidate_keys(response)
+    multiple = _find_candidate_keys(response, additional_responses)
+
+    assert math.prod(len(l) for l in multiple) < math.prod(len(l) for l in single)
+    assert all(ord(c) in points for (c, points) in zip(TEST_ENCRYPTION_KEY, multiple))
+    assert find_key(response, known_plaintext=False, additional_responses=additional_responses) == TEST_ENCRYPTION_KEY
+
+
+def _find_candidate_key_codepoints_reference(encrypted_response: bytes, key_offset: int) -> list[int]:
+    """The original per-byte filter, kept to compare results and speed with"""
+    bytes_to_check = encrypted_response[key_offset::KEY_LEN]
+    return [
+        point for point in KEY_CHARSET_CODEPOINTS
+        if all(point ^ byte in PLAINTEXT_CHARSET_CODEPOINTS for byte in bytes_to_check)
+    ]
+
+
+def test_candidate_key_codepoints_speedup():
+    responses = [
+        bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE),
+        encrypted_fixture("dishwasher/wash.json", TEST_ENCRYPTION_KEY) * 10,
+        encrypted_fixture("oven/heating.json", TEST_ENCRYPTION_KEY) * 50,
+    ]
+
+    for response in responses:
+        for i in range(KEY_LEN):
+            assert list(_find_candidate_key_codepoints(response, i)) == \
+                   _find_candidate_key_codepoints_reference(response, i)
+
+        fast = min(timeit.repeat(
+            lambda r=response: [list(_find_candidate_key_codepoints(r, i)) for i in range(KEY_LEN)],
+            number=3, repeat=3
+        ))
+        reference = min(timeit.repeat(
+            lambda r=response: [_find_candidate_key_codepoints_reference(r, i) for i in range(KEY_LEN)],
+            number=3, repeat=3
+        ))
+        assert fast * 5 < reference
+
+
+def test_is_json_prefix():
+    response = bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE)
+    wrong_key = "fbfjlbmmfklfaikn"  # Last character differs
+
+    assert _is_json_prefix(TEST_ENCRYPTION_KEY.encode(), response)
+    assert not _is_json_prefix(wrong_key.encode(), response)
+
+
+def test_is_json_prefix_plaintext():
+    no_encryption = bytes(KEY_LEN)
+
+    assert _is_json_prefix(no_encryption, b'{"a":"1","b":{"c":[1,true,null,{}],"d":[]}}')
+    assert _is_json_prefix(no_encryption, b'{"a":"\\"1\\""}')
+    assert not _is_json_prefix(no_encryption, b'{"a" "1"}')
+    assert not _is_json_prefix(no_encryption, b'{"a":"1"]')
+    assert not _is_json_prefix(no_encryption, b'{"a":"1"}}')
+    assert not _is_json_prefix(no_encryption, b'{"a":"\x01"}')
+
+
+def test_iter_keys_by_rank():
+    response = encrypted_fixture("tumble_dryer/running.json", TEST_ENCRYPTION_KEY)
+    candidates = _find_candidate_keys(response)
+
+    ranked = _rank_candidates(response, candidates)
+    keys = list(_iter_keys_by_rank(ranked))
+
+    assert len(keys) == math.prod(len(l) for l in candidates)
+    assert sorted(keys) == sorted(itertools.product(*candidates))
+    assert keys[0] == tuple(TEST_ENCRYPTION_KEY.encode())
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_decrypt(use_numpy):
+    response = bytes.fromhex(TEST_ENCRYPTED_HEX_RESPONSE)
+    key = TEST_ENCRYPTION_KEY.encode()
+    expected = bytes(byte ^ key[i % len(key)] for (i, byte) in enumerate(response))
+
+    with patch("custom_components.candy.client.decryption.np", decryption.np if use_numpy else None):
+        decryption._keystream.cache_clear()
+        assert decrypt(key, response) == expected
+        assert decrypt(tuple(key), response[:100]) == expected[:100]
+        decryption._keystream.cache_clear()
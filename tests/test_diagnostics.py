@@ -0,0 +1,28 @@
+"""Tests for the diagnostics of a config entry"""
+from homeassistant.components.diagnostics import REDACTED
+from homeassistant.core import HomeAssistant
+from pytest_homeassistant_custom_component.common import load_fixture
+from pytest_homeassistant_custom_component.test_util.aiohttp import \
+    AiohttpClientMocker
+
+from custom_components.candy.diagnostics import \
+    async_get_config_entry_diagnostics
+from custom_components.candy.polling import UPDATE_INTERVAL_IDLE
+
+from .common import TEST_ENCRYPTION_KEY, init_integration
+
+
+async def test_diagnostics(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    entry = await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+
+    hass.config_entries.async_update_entry(entry, data={**entry.data, "password": TEST_ENCRYPTION_KEY})
+    await hass.async_block_till_done()
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, entry)
+
+    assert diagnostics["entry"]["data"]["password"] == REDACTED
+    assert TEST_ENCRYPTION_KEY not in str(diagnostics)
+    assert diagnostics["circuit_breaker"]["state"] == "closed"
+    assert diagnostics["poll_interval"] == UPDATE_INTERVAL_IDLE.total_seconds()
+    assert diagnostics["last_update_success"]
+    assert diagnostics["request_rate"] > 0
@@ -0,0 +1,200 @@
+"""Tests for setting up the integration"""
+import json
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import (
+    async_fire_time_changed, load_fixture)
+from pytest_homeassistant_custom_component.test_util.aiohttp import \
+    AiohttpClientMocker
+
+from custom_components.candy.const import (CONF_KEY_LIVENESS_PROBE,
+                                           CONF_KEY_MACHINE_TYPE,
+                                           DATA_KEY_COORDINATOR, DOMAIN,
+                                           STALE_WINDOW_DEFAULT,
+                                           STORAGE_KEY_LAST_RESPONSE,
+                                           STORAGE_KEY_REQUEST_RATE,
+                                           STORAGE_KEY_USAGE_HISTOGRAM)
+from custom_components.candy.polling import (UPDATE_INTERVAL_DEFAULT,
+                                             UPDATE_INTERVAL_IDLE,
+                                             retry_interval)
+from custom_components.candy.storage import STORAGE_SAVE_DELAY
+
+from .common import TEST_ENTRY_ID, TEST_IP, init_integration
+
+
+async def test_request_rate_persisted(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker, hass_storage,
+                                      disable_api_rate_limiter):
+    entry = await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=STORAGE_SAVE_DELAY + 1))
+    await hass.async_block_till_done()
+
+    stored_rate = hass_storage[f"{DOMAIN}.{entry.entry_id}"]["data"][STORAGE_KEY_REQUEST_RATE]
+    assert stored_rate == disable_api_rate_limiter.limiter(TEST_IP).rate
+
+
+async def test_request_rate_restored(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker, hass_storage,
+                                     disable_api_rate_limiter):
+    hass_storage[f"{DOMAIN}.{TEST_ENTRY_ID}"] = {
+        "version": 1,
+        "key": f"{DOMAIN}.{TEST_ENTRY_ID}",
+        "data": {STORAGE_KEY_REQUEST_RATE: 0.5},
+    }
+
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+
+    # Restored, and not increased by the first request, which didn't wait for the limiter
+    assert disable_api_rate_limiter.limiter(TEST_IP).rate == pytest.approx(0.5)
+
+
+async def test_update_interval_follows_state(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+    coordinator = hass.data[DOMAIN][TEST_ENTRY_ID][DATA_KEY_COORDINATOR]
+
+    assert coordinator.poll_interval == UPDATE_INTERVAL_IDLE
+
+    aioclient_mock.clear_requests()
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=0",
+        text=load_fixture("washing_machine/running_wash.json")
+    )
+    async_fire_time_changed(hass, dt_util.utcnow() + UPDATE_INTERVAL_IDLE * 2)
+    await hass.async_block_till_done()
+
+    assert coordinator.poll_interval == UPDATE_INTERVAL_DEFAULT
+
+
+async def test_cycle_start_recorded(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker, hass_storage):
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+    coordinator = hass.data[DOMAIN][TEST_ENTRY_ID][DATA_KEY_COORDINATOR]
+
+    aioclient_mock.clear_requests()
+    aioclient_mock.get(
+        f"http://{TEST_IP}/http-read.json?encrypted=0",
+        text=load_fixture("washing_machine/running_wash.json")
+    )
+    async_fire_time_changed(hass, dt_util.utcnow() + coordinator.poll_interval * 2)
+    await hass.async_block_till_done()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=STORAGE_SAVE_DELAY + 1))
+    await hass.async_block_till_done()
+
+    assert sum(coordinator.usage.counts) == 1
+    assert hass_storage[f"{DOMAIN}.{TEST_ENTRY_ID}"]["data"][STORAGE_KEY_USAGE_HISTOGRAM] == coordinator.usage.counts
+
+
+async def test_unchanged_status_not_written(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+    coordinator = hass.data[DOMAIN][TEST_ENTRY_ID][DATA_KEY_COORDINATOR]
+    listener = MagicMock()
+    coordinator.async_add_listener(listener)
+
+    async_fire_time_changed(hass, dt_util.utcnow() + coordinator.poll_interval * 2)
+    await hass.async_block_till_done()
+
+    assert coordinator.client.unchanged_responses == 1
+    listener.assert_not_called()
+
+
+async def test_machine_type_persisted(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    entry = await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+
+    assert entry.data[CONF_KEY_MACHINE_TYPE] == "statusLavatrice"
+
+
+def _saved_status(hass_storage, fixture: str) -> None:
+    hass_storage[f"{DOMAIN}.{TEST_ENTRY_ID}"] = {
+        "version": 1,
+        "key": f"{DOMAIN}.{TEST_ENTRY_ID}",
+        "data": {STORAGE_KEY_LAST_RESPONSE: json.loads(load_fixture(fixture))},
+    }
+
+
+async def test_setup_from_saved_status_when_offline(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker,
+                                                    hass_storage, disable_liveness_probe, freezer):
+    _saved_status(hass_storage, "washing_machine/running_wash.json")
+    disable_liveness_probe.return_value.is_alive.return_value = False
+
+    with patch("custom_components.candy.scheduler.STARTUP_STAGGER", 100):
+        entry = await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"),
+                                       options={CONF_KEY_LIVENESS_PROBE: True})
+
+    assert entry.state is ConfigEntryState.LOADED
+    state = hass.states.get("sensor.washing_machine")
+    assert state.state == "Running"
+    assert state.attributes["stale"] is True
+
+    # The refresh in the background fails, like it would have failed the setup, the saved status is kept
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=101))
+    await hass.async_block_till_done()
+
+    assert entry.state is ConfigEntryState.LOADED
+    state = hass.states.get("sensor.washing_machine")
+    assert state.state == "Running"
+    assert state.attributes["stale"] is True
+    assert "age_seconds" not in state.attributes
+
+    freezer.tick(timedelta(minutes=STALE_WINDOW_DEFAULT))
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(minutes=STALE_WINDOW_DEFAULT))
+    await hass.async_block_till_done()
+
+    assert hass.states.get("sensor.washing_machine").state == "unavailable"
+
+
+async def test_saved_status_refreshed_in_background(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker,
+                                                    hass_storage):
+    _saved_status(hass_storage, "washing_machine/running_wash.json")
+
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=STORAGE_SAVE_DELAY + 1))
+    await hass.async_block_till_done()
+
+    assert aioclient_mock.call_count == 1
+    state = hass.states.get("sensor.washing_machine")
+    assert state.state == "Idle"
+    assert "stale" not in state.attributes
+    saved = hass_storage[f"{DOMAIN}.{TEST_ENTRY_ID}"]["data"][STORAGE_KEY_LAST_RESPONSE]
+    assert saved == json.loads(load_fixture("washing_machine/idle.json"))
+
+
+async def test_unchanged_saved_status_no_longer_stale(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker,
+                                                      hass_storage):
+    _saved_status(hass_storage, "washing_machine/idle.json")
+
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"))
+    await hass.async_block_till_done()
+
+    assert aioclient_mock.call_count == 1
+    assert "stale" not in hass.states.get("sensor.washing_machine").attributes
+
+
+async def test_last_status_kept_while_device_is_offline(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker,
+                                                        disable_liveness_probe, freezer):
+    await init_integration(hass, aioclient_mock, load_fixture("washing_machine/idle.json"),
+                           options={CONF_KEY_LIVENESS_PROBE: True})
+    coordinator = hass.data[DOMAIN][TEST_ENTRY_ID][DATA_KEY_COORDINATOR]
+    disable_liveness_probe.return_value.is_alive.return_value = False
+
+    freezer.tick(timedelta(seconds=30))
+    async_fire_time_changed(hass, dt_util.utcnow() + coordinator.poll_interval * 2)
+    await hass.async_block_till_done()
+
+    state = hass.states.get("sensor.washing_machine")
+    assert state.state == "Idle"
+    assert state.attributes["stale"] is True
+    assert state.attributes["age_seconds"] == 30
+    assert coordinator.poll_interval == retry_interval(1)
+
+    disable_liveness_probe.return_value.is_alive.return_value = True
+    async_fire_time_changed(hass, dt_util.utcnow() + coordinator.poll_interval * 2)
+    await hass.async_block_till_done()
+
+    state = hass.states.get("sensor.washing_machine")
+    assert state.state == "Idle"
+    assert "stale" not in state.attributes
+    assert coordinator.failed_polls == 0
@@ -0,0 +1,145 @@
+"""Tests for choosing the poll interval"""
+import dataclasses
+import json
+from datetime import datetime, timedelta
+
+from pytest_homeassistant_custom_component.common import load_fixture
+
+from custom_components.candy.client.connection import KEEPALIVE_TIMEOUT
+from custom_components.candy.client.model import (DishwasherState,
+                                                  DishwasherStatus,
+                                                  MachineState,
+                                                  OvenStatus,
+                                                  TumbleDryerStatus,
+                                                  WashingMachineStatus)
+from custom_components.candy.polling import (MIN_OBSERVED_STARTS,
+                                             UPDATE_INTERVAL_ACTIVE,
+                                             UPDATE_INTERVAL_DEFAULT,
+                                             UPDATE_INTERVAL_IDLE,
+                                             UPDATE_INTERVAL_QUIET_HOURS,
+                                             UPDATE_INTERVAL_RETRY_MAX,
+                                             UPDATE_INTERVAL_TRANSITION,
+                                             UsageHistogram,
+                                             next_update_interval, poll_phase,
+                                             retry_interval)
+
+# A Monday
+EVENING = datetime(2024, 1, 1, 19, 30)
+NIGHT = datetime(2024, 1, 1, 3, 30)
+
+
+def _washing_machine(fixture: str) -> WashingMachineStatus:
+    return WashingMachineStatus.from_json(json.loads(load_fixture(fixture))["statusLavatrice"])
+
+
+def test_idle_devices():
+    assert next_update_interval(_washing_machine("washing_machine/idle.json")) == UPDATE_INTERVAL_IDLE
+    assert next_update_interval(TumbleDryerStatus.from_json(
+        json.loads(load_fixture("tumble_dryer/idle.json"))["statusTD"]
+    )) == UPDATE_INTERVAL_IDLE
+    assert next_update_interval(DishwasherStatus.from_json(
+        json.loads(load_fixture("dishwasher/idle.json"))["statusDWash"]
+    )) == UPDATE_INTERVAL_IDLE
+    assert next_update_interval(OvenStatus.from_json(
+        json.loads(load_fixture("oven/idle.json"))["statusForno"]
+    )) == UPDATE_INTERVAL_IDLE
+
+
+def test_finished_devices():
+    washing_machine = _washing_machine("washing_machine/idle.json")
+    dishwasher = DishwasherStatus.from_json(json.loads(load_fixture("dishwasher/idle.json"))["statusDWash"])
+
+    for status in [
+        dataclasses.replace(washing_machine, machine_state=MachineState.FINISHED1),
+        dataclasses.replace(washing_machine, machine_state=MachineState.FINISHED2),
+        dataclasses.replace(dishwasher, machine_state=DishwasherState.FINISHED),
+    ]:
+        assert next_update_interval(status) == UPDATE_INTERVAL_IDLE
+
+
+def test_running_cycle():
+    status = _washing_machine("washing_machine/running_wash.json")
+
+    assert next_update_interval(dataclasses.replace(status, remaining_minutes=40)) == UPDATE_INTERVAL_DEFAULT
+    assert next_update_interval(dataclasses.replace(status, remaining_minutes=3)) == UPDATE_INTERVAL_TRANSITION
+
+
+def test_delayed_start():
+    status = _washing_machine("washing_machine/delayed_start_wait.json")
+
+    assert next_update_interval(status) == UPDATE_INTERVAL_DEFAULT
+
+
+def test_dishwasher_running():
+    status = DishwasherStatus.from_json(json.loads(load_fixture("dishwasher/wash.json"))["statusDWash"])
+
+    assert next_update_interval(dataclasses.replace(status, remaining_minutes=2)) == UPDATE_INTERVAL_TRANSITION
+
+
+def test_oven_heating():
+    status = OvenStatus.from_json(json.loads(load_fixture("oven/heating.json"))["statusForno"])
+
+    assert next_update_interval(dataclasses.replace(status, temp_reached=False)) == UPDATE_INTERVAL_ACTIVE
+    assert next_update_interval(dataclasses.replace(status, temp_reached=True)) == UPDATE_INTERVAL_DEFAULT
+
+
+def test_usage_histogram_quiet_hours():
+    usage = UsageHistogram()
+    for week in range(MIN_OBSERVED_STARTS):
+        usage.record_start(EVENING + timedelta(weeks=week))
+
+    assert usage.is_quiet(NIGHT)
+    assert not usage.is_quiet(EVENING)
+    # The next hour has cycle starts
+    assert not usage.is_quiet(EVENING - timedelta(hours=1))
+
+
+def test_usage_histogram_not_enough_data():
+    usage = UsageHistogram()
+    usage.record_start(EVENING)
+
+    assert not usage.is_quiet(NIGHT)
+
+
+def test_usage_histogram_restore():
+    usage = UsageHistogram()
+    usage.record_start(EVENING)
+
+    assert UsageHistogram(usage.counts).counts == usage.counts
+    # Invalid persisted data is discarded
+    assert sum(UsageHistogram([1, 2, 3]).counts) == 0
+
+
+def test_quiet_hours_interval():
+    usage = UsageHistogram()
+    for week in range(MIN_OBSERVED_STARTS):
+        usage.record_start(EVENING + timedelta(weeks=week))
+    idle = _washing_machine("washing_machine/idle.json")
+    running = _washing_machine("washing_machine/running_wash.json")
+
+    assert next_update_interval(idle, usage, NIGHT) == UPDATE_INTERVAL_QUIET_HOURS
+    assert next_update_interval(idle, usage, EVENING) == UPDATE_INTERVAL_IDLE
+    assert next_update_interval(running, usage, NIGHT) == UPDATE_INTERVAL_DEFAULT
+    # Left finished in the evening, nobody empties it at night
+    finished = dataclasses.replace(idle, machine_state=MachineState.FINISHED1)
+    assert next_update_interval(finished, usage, NIGHT) == UPDATE_INTERVAL_QUIET_HOURS
+
+
+def test_poll_phase_is_stable_and_spread():
+    phases = [poll_phase(f"entry-{i}") for i in range(100)]
+
+    assert phases == [poll_phase(f"entry-{i}") for i in range(100)]
+    assert all(0 <= phase < 1 for phase in phases)
+    # Every tenth of the interval has some of the devices
+    assert {int(phase * 10) for phase in phases} == set(range(10))
+
+
+def test_keepalive_outlasts_poll_intervals():
+    # Polls of an entry are up to one and a half intervals apart, depending on its phase
+    assert KEEPALIVE_TIMEOUT > UPDATE_INTERVAL_QUIET_HOURS.total_seconds() * 1.5
+
+
+def test_retry_interval_backs_off():
+    assert retry_interval(1) == UPDATE_INTERVAL_DEFAULT
+    assert retry_interval(2) == UPDATE_INTERVAL_DEFAULT * 2
+    assert retry_interval(1000) == UPDATE_INTERVAL_RETRY_MAX
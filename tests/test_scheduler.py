@@ -0,0 +1,129 @@
+"""Tests for polling every device with a shared scheduler"""
+import asyncio
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import (
+    MockConfigEntry, async_fire_time_changed, load_fixture)
+from pytest_homeassistant_custom_component.test_util.aiohttp import (
+    AiohttpClientMocker, AiohttpClientMockResponse)
+
+from custom_components.candy.client import CandyClient
+from custom_components.candy.const import DATA_KEY_SCHEDULER, DOMAIN
+from custom_components.candy.polling import UPDATE_INTERVAL_IDLE, poll_phase
+from custom_components.candy.scheduler import (COALESCE_WINDOW,
+                                               CandyPollScheduler)
+
+from .common import init_integration
+
+
+def _mock_coordinator(refresh=None, interval: timedelta = timedelta(seconds=60)) -> MagicMock:
+    coordinator = MagicMock(poll_interval=interval)
+    coordinator.async_refresh.side_effect = refresh
+    return coordinator
+
+
+async def test_entries_share_timer(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    status = load_fixture("washing_machine/idle.json")
+    # Entries at the same phase are due at the same time
+    with patch("custom_components.candy.scheduler.poll_phase", return_value=0.5):
+        await init_integration(hass, aioclient_mock, status, entry_id="first")
+        await init_integration(hass, aioclient_mock, status, entry_id="second")
+        scheduler = hass.data[DOMAIN][DATA_KEY_SCHEDULER]
+        aioclient_mock.clear_requests()
+        aioclient_mock.get("http://192.168.0.66/http-read.json?encrypted=0", text=status)
+
+        async_fire_time_changed(hass, dt_util.utcnow() + UPDATE_INTERVAL_IDLE * 2)
+        await hass.async_block_till_done()
+
+    assert aioclient_mock.call_count == 2
+    assert scheduler.polls == 2
+    assert scheduler.wakeups == 1
+
+
+async def test_concurrency_bound(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker):
+    scheduler = CandyPollScheduler(hass, max_concurrent_requests=2)
+    status = load_fixture("washing_machine/idle.json")
+    running = 0
+    max_running = 0
+
+    async def respond(method, url, data):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return AiohttpClientMockResponse(method, url, text=status)
+
+    clients = []
+    for i in range(5):
+        aioclient_mock.get(f"http://192.168.0.{i}/http-read.json?encrypted=0", side_effect=respond)
+        clients.append(CandyClient(async_get_clientsession(hass), f"192.168.0.{i}", encryption_key="",
+                                   use_encryption=False, request_slots=scheduler.request_slots))
+    await asyncio.gather(*(client.status() for client in clients))
+
+    assert aioclient_mock.call_count == 5
+    assert max_running == 2
+
+
+async def test_rate_limited_client_holds_no_request_slot(hass: HomeAssistant, aioclient_mock: AiohttpClientMocker,
+                                                         disable_api_rate_limiter):
+    scheduler = CandyPollScheduler(hass, max_concurrent_requests=1)
+    status = load_fixture("washing_machine/idle.json")
+    aioclient_mock.get("http://192.168.0.1/http-read.json?encrypted=0", text=status)
+    aioclient_mock.get("http://192.168.0.2/http-read.json?encrypted=0", text=status)
+    limited = CandyClient(async_get_clientsession(hass), "192.168.0.1", encryption_key="", use_encryption=False,
+                          request_rate=disable_api_rate_limiter.min_rate, request_slots=scheduler.request_slots)
+    other = CandyClient(async_get_clientsession(hass), "192.168.0.2", encryption_key="", use_encryption=False,
+                        request_slots=scheduler.request_slots)
+
+    await limited.status()
+    # Waits for its rate limiter now
+    waiting = asyncio.create_task(limited.status())
+    await asyncio.sleep(0)
+
+    await asyncio.wait_for(other.status(), timeout=1)
+    assert not waiting.done()
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+
+async def test_polls_spread_over_interval(hass: HomeAssistant):
+    scheduler = CandyPollScheduler(hass)
+    for i in range(40):
+        entry = MockConfigEntry(domain=DOMAIN, entry_id=f"entry-{i}")
+        entry.add_to_hass(hass)
+        scheduler.async_add(entry, _mock_coordinator())
+
+    # Without phases, all of them would be polled in the same wakeup
+    due = sorted(scheduler._due.values())
+    busiest = max(sum(start <= other < start + COALESCE_WINDOW for other in due) for start in due)
+    assert busiest <= 4
+    for i in range(40):
+        scheduler.async_remove(f"entry-{i}")
+
+
+async def test_next_due_at_phase(hass: HomeAssistant):
+    scheduler = CandyPollScheduler(hass)
+    entry = MockConfigEntry(domain=DOMAIN, entry_id="phase")
+    entry.add_to_hass(hass)
+    scheduler.async_add(entry, _mock_coordinator())
+
+    due = scheduler._due["phase"] - hass.loop.time()
+    assert 30 <= due < 90
+    assert (scheduler._due["phase"] % 60) / 60 == pytest.approx(poll_phase("phase"), abs=1e-6)
+    scheduler.async_remove("phase")
+
+
+def test_startup_delay_follows_phase():
+    with patch("custom_components.candy.scheduler.STARTUP_STAGGER", 10):
+        delays = [CandyPollScheduler.startup_delay(f"entry-{i}") for i in range(10)]
+    phases = [poll_phase(f"entry-{i}") for i in range(10)]
+
+    assert all(0 <= delay < 10 for delay in delays)
+    assert sorted(range(10), key=delays.__getitem__) == sorted(range(10), key=phases.__getitem__)
@@ -0,0 +1,85 @@
+"""Tests of the client against the appliance simulator"""
+import aiohttp
+import pytest
+
+from benchmarks.simulator import (ENCRYPTION_HEX, ENCRYPTION_KEY,
+                                  ENCRYPTION_NONE, SimulatedAppliance,
+                                  Simulator, SimulatorProcess)
+from custom_components.candy.client import (BadRequestError, CandyClient,
+                                            Encryption, detect_encryption)
+from custom_components.candy.client.model import (DishwasherStatus,
+                                                  OvenStatus,
+                                                  TumbleDryerStatus,
+                                                  WashingMachineStatus)
+
+from .common import TEST_ENCRYPTION_KEY
+
+
+@pytest.mark.parametrize("machine_type,status_type", [
+    ("washing_machine", WashingMachineStatus),
+    ("tumble_dryer", TumbleDryerStatus),
+    ("oven", OvenStatus),
+    ("dishwasher", DishwasherStatus),
+])
+async def test_detect_encryption_and_status(socket_enabled, machine_type, status_type):
+    appliances = [
+        SimulatedAppliance(machine_type, ENCRYPTION_NONE),
+        SimulatedAppliance(machine_type, ENCRYPTION_KEY, key=TEST_ENCRYPTION_KEY),
+        SimulatedAppliance(machine_type, ENCRYPTION_HEX),
+    ]
+    expected = [(Encryption.NO_ENCRYPTION, None), (Encryption.ENCRYPTION, TEST_ENCRYPTION_KEY),
+                (Encryption.ENCRYPTION_WITHOUT_KEY, None)]
+
+    async with Simulator(appliances) as simulator, aiohttp.ClientSession() as session:
+        for (device_ip, (encryption, key)) in zip(simulator.device_ips, expected):
+            assert await detect_encryption(session, device_ip) == (encryption, key)
+
+            client = CandyClient(session, device_ip, encryption_key=key or "",
+                                 use_encryption=encryption is not Encryption.NO_ENCRYPTION)
+            assert isinstance(await client.status(), status_type)
+
+
+def test_cycle_progression():
+    appliance = SimulatedAppliance("dishwasher", ENCRYPTION_NONE, idle_seconds=60, cycle_seconds=600)
+    # A round start time, so that the cycle boundaries are exact
+    started_at = appliance._started_at = 1000.0
+
+    assert appliance.status(started_at)["statusDWash"]["StatoDWash"] == "0"
+    running = appliance.status(started_at + 60 + 120)["statusDWash"]
+    assert running["StatoDWash"] == "2"
+    assert running["RemTime"] == "8"
+    assert appliance.status(started_at + 660)["statusDWash"]["StatoDWash"] == "0"
+
+
+async def test_faults(socket_enabled):
+    appliances = [
+        SimulatedAppliance("oven", ENCRYPTION_NONE, min_request_interval=60),
+        SimulatedAppliance("oven", ENCRYPTION_NONE, drop_rate=1),
+    ]
+
+    async with Simulator(appliances) as simulator, aiohttp.ClientSession() as session:
+        rate_limited = CandyClient(session, simulator.device_ips[0], encryption_key="", use_encryption=False)
+        await rate_limited.status()
+        with pytest.raises(BadRequestError):
+            await rate_limited.status()
+
+        dropping = CandyClient(session, simulator.device_ips[1], encryption_key="", use_encryption=False)
+        with pytest.raises(aiohttp.ClientError):
+            await dropping.status()
+
+    assert appliances[0].bad_requests == 1
+    assert appliances[1].dropped == 1
+
+
+async def test_simulator_process(socket_enabled):
+    appliances = [SimulatedAppliance("oven", ENCRYPTION_NONE)]
+
+    async with SimulatorProcess(appliances) as simulator, aiohttp.ClientSession() as session:
+        client = CandyClient(session, simulator.device_ips[0], encryption_key="", use_encryption=False)
+        assert isinstance(await client.status(), OvenStatus)
+
+        collected = await simulator.collect()
+        assert collected[0].requests == 1
+
+    assert simulator.appliances[0].requests == 1
+    assert len(simulator.appliances[0].request_times) == 1